@@ -6,6 +6,10 @@ from .analogoutNoise import FicTracAoutNoise
 from .aoutBlockExperiment import BlockAout
 from .aout import TestAout
 from .aoutGainExperiment import GainOutput
+from .aout_runner import AoutRunner
+from .aout_engine import AoutEngine
+from .aoutProtocolExperiment import ProtocolOutput
+from .aoutVirtualHallway import HallwayAout
 
 
 __version__ = '0.0.1'
@@ -0,0 +1,56 @@
+from __future__ import print_function # 'print' became a function in Python 3. This __future__ import is to make it always be used as a function, even when running th code in previous Python version
+
+try:
+    from .aout_runner import AoutRunner # shared redis/phidget setup and listen loop
+    from .protocol import Protocol, load_protocol # multi-block protocols
+except ImportError:
+    from aout_runner import AoutRunner
+    from protocol import Protocol, load_protocol
+
+
+class ProtocolOutput(AoutRunner):
+    """
+            Output fly heading, posx, posy into 0 to 10 V, with the yaw_gain channel
+            following a multi-block protocol (see protocol.Protocol)
+
+
+
+        """
+
+    DefaultParam = {
+        'rate_to_volt_const': 50,
+        'aout_channel_yaw': 0,
+        'aout_channel_x': 1,
+        'aout_channel_yaw_gain': 2,
+        'aout_channel_y': 3,
+        'aout_max_volt': 10.0,
+        'aout_min_volt': 0.0,
+        'aout_max_volt_vel': 10.0,
+        'aout_min_volt_vel': -10.0,
+    }
+
+    def __init__(self, param=DefaultParam):
+        AoutRunner.__init__(self, param)
+        self.protocol = None
+
+    def run(self, protocol):
+        """
+        Listen for new messages on "fictrac" channel and output the analog voltages for
+        each new message until the end of the protocol. protocol is a Protocol, a list of
+        blocks or the path of a JSON/YAML protocol file.
+        """
+        if isinstance(protocol, str):
+            protocol = load_protocol(protocol)
+        elif not isinstance(protocol, Protocol):
+            protocol = Protocol(protocol)
+        self.protocol = protocol
+        for i, block in enumerate(protocol.blocks):
+            if 'seed' in block:
+                print('block {0} noise seed: {1}'.format(i + 1, block['seed']))
+        self.record_param(protocol=protocol.blocks) # with the noise seeds
+        self.engine.set_transform(protocol)
+        self.listen(protocol.duration)
+
+    def format_status(self, snapshot):
+        return AoutRunner.format_status(self, snapshot) + '  block: {0}/{1}'.format(
+            self.protocol.block + 1, len(self.protocol.blocks))
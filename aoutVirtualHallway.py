@@ -0,0 +1,91 @@
+from __future__ import print_function # 'print' became a function in Python 3. This __future__ import is to make it always be used as a function, even when running th code in previous Python version
+
+try:
+    from .aout_runner import AoutRunner # shared redis/phidget setup and listen loop
+    from .aout_engine import GainTransform # yaw_gain feedback transforms
+    from .virtual_hallway import Hallway, HallwayEngine, WALL, REWARD
+except ImportError:
+    from aout_runner import AoutRunner
+    from aout_engine import GainTransform
+    from virtual_hallway import Hallway, HallwayEngine, WALL, REWARD
+
+
+class HallwayAout(AoutRunner):
+    """
+            Output fly heading, posx, posy into 0 to 10 V, and walk the fly down a
+            virtual hallway: the reward channel is high while the fly is in a reward
+            zone and the punishment channel while it pushes against a wall
+
+
+
+        """
+
+    DefaultParam = {
+        'rate_to_volt_const': 50,
+        'aout_channel_yaw': 0,
+        'aout_channel_x': 1,
+        'aout_channel_yaw_gain': 2,
+        'aout_channel_y': 3,
+        'aout_channel_reward': 4,
+        'aout_channel_punish': 5,
+        'aout_max_volt': 10.0,
+        'aout_min_volt': 0.0,
+        'aout_max_volt_vel': 10.0,
+        'aout_min_volt_vel': -10.0,
+        'reward_volt': 5.0,
+        'punish_volt': 5.0,
+        'hallway_width': 20.0, # mm
+        'hallway_length': 200.0, # mm
+        'hallway_rewards': (50.0, 150.0), # y of the reward zones (mm)
+        'reward_size': 5.0, # length of a reward zone along the hallway (mm)
+        'ball_radius': 4.5, # mm
+    }
+
+    def __init__(self, param=DefaultParam):
+        AoutRunner.__init__(self, param)
+        self.hallway = Hallway(self.param['hallway_width'], self.param['hallway_length'],
+                               self.param['hallway_rewards'], self.param['reward_size'])
+        self.hallway_engine = HallwayEngine(self.hallway, self.param['ball_radius'])
+
+        self.aout_reward = self.aouts['reward']
+        self.aout_punish = self.aouts['punish']
+        self.rewarded = False
+        self.punished = False
+
+    def run(self, gain_yaw = 1, duration = None):
+        """
+        Listen for new messages on "fictrac" channel, output the analog voltages and
+        move the fly through the hallway for each new message (until duration s if given)
+        """
+        self.engine.set_transform(GainTransform(gain_yaw))
+        self.listen(duration)
+
+    def extra_channels(self):
+        # reward and punishment outputs are attached with the other four
+        return [('reward', self.param['aout_channel_reward']), ('punish', self.param['aout_channel_punish'])]
+
+    def on_frame(self, data, time_ns):
+        zone = self.hallway_engine.update(data)
+        # only write the reward/punishment channels when they change
+        rewarded = zone == REWARD
+        if rewarded != self.rewarded:
+            self.rewarded = rewarded
+            self.aout_reward.setVoltage(self.param['reward_volt'] if rewarded else 0.0)
+        punished = zone == WALL
+        if punished != self.punished:
+            self.punished = punished
+            self.aout_punish.setVoltage(self.param['punish_volt'] if punished else 0.0)
+
+    def on_reset(self):
+        self.hallway_engine.reset()
+
+    def close(self):
+        self.aout_reward.setVoltage(0.0)
+        self.aout_punish.setVoltage(0.0)
+        self.rewarded = self.punished = False
+        AoutRunner.close(self)
+
+    def format_status(self, snapshot):
+        engine = self.hallway_engine
+        return AoutRunner.format_status(self, snapshot) + '  hallway: ({0:1.1f}, {1:1.1f}) mm{2}{3}'.format(
+            engine.x, engine.y, '  REWARD' if self.rewarded else '', '  WALL' if self.punished else '')
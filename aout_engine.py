@@ -0,0 +1,338 @@
+from __future__ import print_function
+import math
+import numpy as np
+
+try:
+    from .experiment_clock import BlockTimer
+    from .noise_source import NoiseBuffer
+    from .volt_map import ChannelMap
+except ImportError:
+    from experiment_clock import BlockTimer
+    from noise_source import NoiseBuffer
+    from volt_map import ChannelMap
+
+
+class AoutEngine(object):
+    """
+    Per-frame closed-loop engine shared by all the analog output classes.
+
+    Maps one FicTrac data frame onto the four output voltages (yaw, x, yaw_gain, y).
+    The channel scale factors are computed once here instead of on every frame, and
+    the yaw_gain channel is produced by a pluggable feedback transform (gain, noise,
+    offset jump, block schedule).
+    """
+
+    DefaultParam = {
+        'aout_max_volt': 10.0,
+        'aout_min_volt': 0.0,
+    }
+
+    def __init__(self, param, transform=None):
+        self.param = param
+        self.volt_min = float(param['aout_min_volt'])
+        self.volt_max = float(param['aout_max_volt'])
+        self.volt_range = self.volt_max - self.volt_min
+
+        # Channel scale factors (volts per unit)
+        self.yaw_scale = self.volt_range / 360.0
+        self.int_scale = self.volt_range / (2 * math.pi)
+
+        # Channel transfer functions (panels move opposite to fictrac, so yaw and yaw_gain are inverted about the range)
+        self.yaw_map = ChannelMap(self.volt_min, self.volt_max, self.yaw_scale, invert=True)
+        self.int_map = ChannelMap(self.volt_min, self.volt_max, self.int_scale, period=2 * math.pi)
+        self.yaw_gain_map = ChannelMap(self.volt_min, self.volt_max, invert=True)
+        self.yaw_volt = self.yaw_map.scalar
+        self.int_volt = self.int_map.scalar
+        self.yaw_gain_volt = self.yaw_gain_map.scalar
+
+        self.transform = None
+        self.set_transform(GainTransform(1) if transform is None else transform)
+        self.reset()
+
+    def set_transform(self, transform):
+        """
+        Replace the feedback transform driving the yaw_gain channel
+        """
+        transform.setup(self)
+        self.transform = transform
+
+    def reset(self):
+        """
+        Clear the accumulators, e.g. when FicTrac is restarted
+        """
+        self.accum_heading = 0.0
+        self.accum_x = 0.0
+        self.accum_y = 0.0
+        self.heading = 0.0
+        self.velheading = 0.0
+        self.intx = 0.0
+        self.inty = 0.0
+        self.heading_gain_adjusted = 0.0
+        self.transform.reset()
+
+    def accumulate(self, data):
+        """
+        Add a frame's deltas to the accumulators without computing outputs (for frames
+        that are dropped because a newer one is already waiting)
+        """
+        self.accum_heading += data.deltaheading
+        self.accum_x += data.velx
+        self.accum_y += data.vely
+
+    def update(self, data, time_ns):
+        """
+        Accumulate one FicTrac data frame (a FicTracFrame or anything with the same
+        attributes) at experiment time time_ns (integer ns) and return the
+        (yaw, x, yaw_gain, y) voltages
+        """
+        heading = data.heading
+        velheading = data.deltaheading
+        self.accum_heading += velheading
+        self.accum_x += data.velx
+        self.accum_y += data.vely
+        self.heading = heading
+        self.velheading = velheading
+
+        # YAW: heading 0-360 deg onto the voltage range, inverted
+        volt_yaw = self.yaw_volt(heading)
+
+        # X and Y: integrated position wrapped to 2pi
+        intx = data.intx
+        inty = data.inty
+        int_volt = self.int_volt
+        volt_x = int_volt(intx)
+        volt_y = int_volt(inty)
+        self.intx = intx
+        self.inty = inty
+
+        # YAW_GAIN: accumulated heading through the feedback transform, inverted
+        heading_gain_adjusted, volt = self.transform(self.accum_heading, time_ns)
+        volt_yaw_gain = self.yaw_gain_volt(volt)
+        self.heading_gain_adjusted = heading_gain_adjusted
+
+        return volt_yaw, volt_x, volt_yaw_gain, volt_y
+
+    @property
+    def wrapped_intx(self):
+        """
+        Last integrated x wrapped to 2pi, as mapped onto the x channel
+        """
+        return self.intx % self.int_map.period
+
+    @property
+    def wrapped_inty(self):
+        return self.inty % self.int_map.period
+
+    def update_array(self, records, time_ns):
+        """
+        Vectorized update() over a whole session: records is a structured array (or
+        anything indexable by field name) of data frames and time_ns the matching
+        array of experiment times (integer ns). Returns a structured array with output_dtype, bit-identical
+        to calling update() frame by frame (noise included, for the same noise seed), and leaves the
+        accumulators as update() would.
+        """
+        n = len(records)
+        time_ns = np.asarray(time_ns, dtype=np.int64)
+
+        # np.add.accumulate sums sequentially, so this matches the += of the live loop
+        accum_heading = np.cumsum(np.concatenate(([self.accum_heading], records['deltaheading'])))[1:]
+        self.accum_x = np.cumsum(np.concatenate(([self.accum_x], records['velx'])))[-1]
+        self.accum_y = np.cumsum(np.concatenate(([self.accum_y], records['vely'])))[-1]
+
+        out = np.empty(n, dtype=output_dtype)
+        out['accum_heading'] = accum_heading
+        out['volt_yaw'] = self.yaw_map.array(records['heading'])
+        out['volt_x'] = self.int_map.array(records['intx'])
+        out['volt_y'] = self.int_map.array(records['inty'])
+        heading_gain_adjusted, volt = self.transform.apply_array(accum_heading, time_ns)
+        out['heading_gain_adjusted'] = heading_gain_adjusted
+        out['volt_yaw_gain'] = self.yaw_gain_map.array(volt)
+
+        if n:
+            self.accum_heading = accum_heading[-1]
+            self.heading = records['heading'][-1]
+            self.velheading = records['deltaheading'][-1]
+            self.intx = records['intx'][-1]
+            self.inty = records['inty'][-1]
+            self.heading_gain_adjusted = heading_gain_adjusted[-1]
+        return out
+
+
+# Per-frame outputs of AoutEngine.update_array
+output_dtype = np.dtype([
+    ('volt_yaw', np.float64),
+    ('volt_x', np.float64),
+    ('volt_yaw_gain', np.float64),
+    ('volt_y', np.float64),
+    ('accum_heading', np.float64),
+    ('heading_gain_adjusted', np.float64),
+])
+
+
+# Feedback transforms
+# ---------------------------------------------------------------------------------------
+class FeedbackTransform(object):
+    """
+    Base class for yaw_gain feedback transforms.
+
+    Calling the transform with (accum_heading, time_ns) returns the displayed
+    heading and the unclamped, non-inverted channel voltage. apply_array() does the
+    same over whole arrays for offline replay. block is the index of the current
+    block for transforms that switch over time.
+    """
+
+    block = 0
+
+    def setup(self, engine):
+        self.volt_range = engine.volt_range
+
+    def reset(self):
+        pass
+
+    def close(self):
+        """
+        Release background resources (e.g. noise refill threads)
+        """
+        pass
+
+    def __call__(self, accum_heading, time_ns):
+        raise NotImplementedError
+
+    def apply_array(self, accum_heading, time_ns):
+        raise NotImplementedError
+
+
+class GainTransform(FeedbackTransform):
+    """
+    Accumulated heading wrapped to 360/gain deg, so one panel revolution takes 360/gain deg of turning
+    """
+
+    def __init__(self, gain=1):
+        self.gain = gain
+
+    def setup(self, engine):
+        FeedbackTransform.setup(self, engine)
+        self.period = 360.0 / self.gain
+        self.scale = self.volt_range / self.period
+
+    def __call__(self, accum_heading, time_ns):
+        heading_gain_adjusted = accum_heading % self.period
+        return heading_gain_adjusted, heading_gain_adjusted * self.scale
+
+    def apply_array(self, accum_heading, time_ns):
+        heading_gain_adjusted = np.mod(accum_heading, self.period)
+        return heading_gain_adjusted, heading_gain_adjusted * self.scale
+
+
+class JumpTransform(GainTransform):
+    """
+    Gain transform with the heading shifted by a fixed offset (e.g. a 90 or -90 deg jump)
+    """
+
+    def __init__(self, gain=1, jump=90):
+        GainTransform.__init__(self, gain)
+        self.jump = jump
+
+    def __call__(self, accum_heading, time_ns):
+        heading_gain_shifted = (accum_heading % self.period + self.jump) % 360
+        return heading_gain_shifted, heading_gain_shifted * self.scale
+
+    def apply_array(self, accum_heading, time_ns):
+        heading_gain_shifted = np.mod(np.mod(accum_heading, self.period) + self.jump, 360)
+        return heading_gain_shifted, heading_gain_shifted * self.scale
+
+
+class NoiseTransform(GainTransform):
+    """
+    Gain transform with clipped gaussian noise (sd noise_sigma V) added to the voltage, wrapped to the voltage range.
+    The noise comes from a pre-generated NoiseBuffer; its seed is kept in noise.seed.
+    """
+
+    def __init__(self, gain=1, noise_clip=0.3, noise_sigma=1.0, seed=None, noise_mode='clip'):
+        GainTransform.__init__(self, gain)
+        self.noise_clip = noise_clip
+        self.noise_sigma = noise_sigma
+        self.noise = NoiseBuffer(noise_sigma, noise_clip, seed, mode=noise_mode)
+        self.next_noise = self.noise.next
+
+    def close(self):
+        self.noise.close()
+
+    def __call__(self, accum_heading, time_ns):
+        heading_gain_adjusted = accum_heading % self.period
+        volt = (heading_gain_adjusted * self.scale + self.next_noise()) % self.volt_range
+        return heading_gain_adjusted, volt
+
+    def apply_array(self, accum_heading, time_ns):
+        heading_gain_adjusted = np.mod(accum_heading, self.period)
+        volt = np.mod(heading_gain_adjusted * self.scale + self.noise.take(len(heading_gain_adjusted)), self.volt_range)
+        return heading_gain_adjusted, volt
+
+
+class OpenLoopTransform(FeedbackTransform):
+    """
+    Open loop: the displayed heading ignores the fly and turns at rate deg/s from heading deg
+    """
+
+    def __init__(self, heading=0.0, rate=0.0):
+        self.heading = heading
+        self.rate = rate
+
+    def setup(self, engine):
+        FeedbackTransform.setup(self, engine)
+        self.scale = self.volt_range / 360.0
+
+    def __call__(self, accum_heading, time_ns):
+        heading = (self.heading + self.rate * (time_ns * 1e-9)) % 360
+        return heading, heading * self.scale
+
+    def apply_array(self, accum_heading, time_ns):
+        heading = np.mod(self.heading + self.rate * (np.asarray(time_ns) * 1e-9), 360)
+        return heading, heading * self.scale
+
+
+class BlockSchedule(FeedbackTransform):
+    """
+    Baseline transform, switched to the perturbed transform from block_time to 2*block_time seconds
+    """
+
+    def __init__(self, baseline, perturbed, block_time=10):
+        self.baseline = baseline
+        self.perturbed = perturbed
+        self.block_time = block_time
+        self.timer = BlockTimer([block_time, 2 * block_time])
+
+    def setup(self, engine):
+        FeedbackTransform.setup(self, engine)
+        self.baseline.setup(engine)
+        self.perturbed.setup(engine)
+
+    def reset(self):
+        self.timer.reset()
+        self.baseline.reset()
+        self.perturbed.reset()
+
+    def close(self):
+        self.baseline.close()
+        self.perturbed.close()
+
+    @property
+    def block(self):
+        return self.timer.index
+
+    def __call__(self, accum_heading, time_ns):
+        if self.timer.block(time_ns) == 1:
+            return self.perturbed(accum_heading, time_ns)
+        return self.baseline(accum_heading, time_ns)
+
+    def apply_array(self, accum_heading, time_ns):
+        # each transform only sees its own frames, as live, so a noise transform draws
+        # the same noise values in replay
+        time_ns = np.asarray(time_ns)
+        in_block = self.timer.blocks(time_ns) == 1
+        heading = np.empty(len(accum_heading))
+        volt = np.empty(len(accum_heading))
+        for transform, mask in ((self.baseline, ~in_block), (self.perturbed, in_block)):
+            if mask.any():
+                heading[mask], volt[mask] = transform.apply_array(accum_heading[mask], time_ns[mask])
+        return heading, volt
@@ -0,0 +1,491 @@
+from __future__ import print_function
+import sys
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from Phidget22.Devices.VoltageOutput import VoltageOutput
+from Phidget22.PhidgetException import PhidgetException
+import Phidget22.Phidget
+
+try:
+    from .aout_engine import AoutEngine, GainTransform, NoiseTransform
+    from .aout_writer import CoalescingWriter
+    from .latency import LatencyRecorder
+    from .status_display import StatusDisplay
+    from .fictrac_decoder import FicTracDecoder
+    from .redis_reader import PubSubReader, RawSubscriber
+    from .loopback import SyntheticSource, FakeVoltageOutput
+    from .experiment_clock import ExperimentClock, seconds_to_ns
+    from .session_recorder import SessionRecorder
+    from .frame_log import FrameLog
+    from .live_display import LiveDisplay
+    from .motion_filter import MotionFilter
+    from .arena import ArenaTracker, load_arena
+except ImportError:
+    from aout_engine import AoutEngine, GainTransform, NoiseTransform
+    from aout_writer import CoalescingWriter
+    from latency import LatencyRecorder
+    from status_display import StatusDisplay
+    from fictrac_decoder import FicTracDecoder
+    from redis_reader import PubSubReader, RawSubscriber
+    from loopback import SyntheticSource, FakeVoltageOutput
+    from experiment_clock import ExperimentClock, seconds_to_ns
+    from session_recorder import SessionRecorder
+    from frame_log import FrameLog
+    from live_display import LiveDisplay
+    from motion_filter import MotionFilter
+    from arena import ArenaTracker, load_arena
+
+
+class AoutRunner(object):
+    """
+            Output fly heading, posx, posy into 0 to 10 V
+
+            Common base for the analog output classes: sets up the redis subscriber and
+            the four phidget channels (plus an optional filtered velocity channel), and
+            runs the listen loop through an AoutEngine.
+
+        """
+
+    DefaultParam = {
+        'rate_to_volt_const': 50,
+        'aout_channel_yaw': 0,
+        'aout_channel_x': 1,
+        'aout_channel_yaw_gain': 2,
+        'aout_channel_y': 3,
+        'aout_max_volt': 10.0,
+        'aout_min_volt': 0.0,
+        'aout_max_volt_vel': 10.0,
+        'aout_min_volt_vel': -10.0,
+        'aout_async_write': False, # write voltages from one background thread per channel, keeping only the newest value
+        'latency_report': False, # time every frame from receive to the last channel write (enqueue, with aout_async_write), reported at shutdown or on SIGUSR1
+        'status_rate': 10.0, # status line refresh rate (Hz)
+        'decoder_backend': None, # 'msgspec', 'orjson' or 'json'; None picks the fastest installed
+        'transport': 'pubsub', # 'pubsub' (redis-py), 'raw' (RESP straight off the socket) or 'synthetic' (in-process source)
+        'synthetic_rate': 500.0, # frame rate (Hz) of the synthetic source
+        'synthetic_frames': None, # number of frames the synthetic source publishes (None: forever)
+        'aout_sink': 'phidget', # 'phidget' or 'fake' (records writes, no hardware)
+        'aout_attach_timeout': 5.0, # overall timeout (s) for attaching the four channels, which are opened in parallel
+        'latest_frame_only': False, # drive the outputs from the newest queued frame only, dropping (but accumulating) the backlog
+        'noise_sigma': 1.0, # sd (V) of the yaw_gain feedback noise
+        'noise_clip': 0.3, # noise limit (V)
+        'noise_mode': 'clip', # 'clip' clamps the noise at +-noise_clip, 'truncate' redraws values beyond it
+        'noise_seed': None, # seed of the pre-generated noise (None: a fresh seed, printed at start)
+        'record_file': None, # file recording every frame and its output voltages
+        'record_format': 'hdf5', # 'hdf5' (plot_pos.Figure2D layout, batched writes) or 'framelog' (memory-mapped binary log)
+        'record_batch': 1000, # frames per batched write of the hdf5 recorder
+        'record_capacity': 10000000, # frames pre-allocated in a frame log
+        'live_display': False, # show the fly's path in a display_2d.Display running in its own process
+        'live_display_rate': 30.0, # live display redraw rate cap (Hz)
+        'aout_channel_vel': None, # channel for the filtered velocity (None: no velocity output)
+        'vel_output': 'heading', # velocity channel signal: 'heading' rate (deg/s), 'forward' or 'side' velocity (rad/s)
+        'rate_filter': 'first_order', # 'first_order', 'biquad' (second order Butterworth), 'butter' (streaming second-order sections) or None
+        'rate_filter_order': 2, # order of the 'butter' rate filter
+        'lowpass_cutoff': 0.5, # rate filter cutoff (Hz)
+        'rate_filter_fs': 500.0, # FicTrac frame rate (Hz): turns per-frame differences into rates for all but the first order filter
+        'arena_file': None, # arena of regions (arena.load_arena) followed with posx/posy, calling on_region() on every enter/exit
+    }
+
+    def __init__(self, param=DefaultParam):
+
+        self.param = dict(AoutRunner.DefaultParam, **param) # options missing from a subclass DefaultParam take the base default
+        self.time_start = time.time()
+        self.clock = ExperimentClock()
+        self.end_ns = None
+        self._watchdog = None
+        self.engine = AoutEngine(self.param)
+        self.decoder = FicTracDecoder(self.param['decoder_backend'])
+
+        # Optional filtered velocity output (channel 'vel'), rate_to_volt_const units per volt
+        self.motion_filter = None
+        if self.param['aout_channel_vel'] is not None:
+            self.motion_filter = MotionFilter(self.param)
+
+        # Setup analog outputs YAW, X, YAW_GAIN and Y, and the subclass's extra_channels(),
+        # all attached in one batch under one timeout before anything else is opened
+        channels = [('yaw', self.param['aout_channel_yaw']), ('x', self.param['aout_channel_x']),
+                    ('yaw_gain', self.param['aout_channel_yaw_gain']), ('y', self.param['aout_channel_y'])]
+        if self.motion_filter is not None:
+            channels.append(('vel', self.param['aout_channel_vel']))
+        channels += self.extra_channels()
+        aouts = self.open_channels(channels)
+        if self.param['aout_async_write']:
+            aouts = [CoalescingWriter(aout, name) for (name, _), aout in zip(channels, aouts)]
+        self.aouts = OrderedDict(zip([name for name, _ in channels], aouts))
+        self.aout_yaw, self.aout_x, self.aout_yaw_gain, self.aout_y = aouts[:4]
+
+        self.aout_vel = self.aouts.get('vel')
+
+        # Optional arena regions, looked up every frame through the arena's grid index
+        self.arena = None
+        if self.param['arena_file']:
+            self.arena = ArenaTracker(load_arena(self.param['arena_file']))
+
+        # Setup the fictrac subscriber
+        self.pubsub = self.open_transport(self.param['transport'])
+
+        # Optional frame-to-voltage latency instrumentation
+        self.latency = None
+        if self.param['latency_report']:
+            self.latency = LatencyRecorder(self.param['aout_async_write'])
+            self.latency.install_signal()
+            if self.param['aout_async_write']:
+                # the loop only times the enqueue; the writer threads time the phidget writes
+                for name in LatencyRecorder.channels:
+                    self.aouts[name].latency = self.latency
+
+        # Optional session recording, written from a background thread
+        self.recorder = None
+        if self.param['record_file']:
+            self.recorder = self.open_recorder(self.param['record_file'], self.param['record_format'])
+
+        # Optional live path display, fed through shared memory
+        self.live_display = None
+        if self.param['live_display']:
+            self.live_display = LiveDisplay(rate=self.param['live_display_rate'])
+
+        self.frames_dropped = 0
+
+        self.print = True
+        self.status = StatusDisplay(self.format_status, self.param['status_rate'])
+
+    @property
+    def accum_heading(self):
+        return self.engine.accum_heading
+
+    @property
+    def accum_x(self):
+        return self.engine.accum_x
+
+    @property
+    def accum_y(self):
+        return self.engine.accum_y
+
+    def open_transport(self, transport):
+        """
+        Subscriber for the "fictrac" channel
+        """
+        if transport == 'pubsub':
+            return PubSubReader('fictrac')
+        if transport == 'raw':
+            return RawSubscriber('fictrac')
+        if transport == 'synthetic':
+            return SyntheticSource(self.param['synthetic_rate'], self.param['synthetic_frames'])
+        raise ValueError('unknown transport {0}'.format(transport))
+
+    def open_recorder(self, file, record_format):
+        """
+        Session recorder writing to file
+        """
+        if record_format == 'hdf5':
+            return SessionRecorder(file, self.param, self.param['record_batch'])
+        if record_format == 'framelog':
+            return FrameLog(file, self.param, self.param['record_capacity'])
+        raise ValueError('unknown record format {0}'.format(record_format))
+
+    def open_channels(self, channels):
+        """
+        Open the (name, channel) phidget voltage outputs concurrently, with one overall
+        attach timeout, and set them to 0 V. Prints the attach time of each channel.
+        If any channel fails to attach, the others are closed and a RuntimeError naming
+        the failed channels is raised as soon as the first failure is known.
+        """
+        timeout = self.param['aout_attach_timeout']
+        aouts = []
+        for name, channel in channels:
+            aout = FakeVoltageOutput() if self.param['aout_sink'] == 'fake' else VoltageOutput()
+            aout.setChannel(channel)
+            aouts.append(aout)
+
+        def attach(aout):
+            t0 = time.perf_counter()
+            aout.openWaitForAttachment(int(timeout * 1000))
+            return time.perf_counter() - t0
+
+        pool = ThreadPoolExecutor(max_workers=len(aouts))
+        try:
+            futures = [pool.submit(attach, aout) for aout in aouts]
+            done, not_done = wait(futures, timeout + 1.0, return_when=FIRST_EXCEPTION)
+            errors = [future for future in done if future.exception() is not None]
+            failed = []
+            for (name, channel), future in zip(channels, futures):
+                if future in errors:
+                    failed.append('{0} (channel {1}): {2}'.format(name, channel, describe_error(future.exception())))
+                elif future in not_done and not errors:
+                    failed.append('{0} (channel {1}): not attached'.format(name, channel))
+            if failed:
+                for aout in aouts:
+                    try:
+                        aout.close()
+                    except Exception:
+                        pass
+                raise RuntimeError('phidget voltage output(s) failed to attach within {0:g} s: {1}'.format(
+                    timeout, '; '.join(failed)))
+        finally:
+            pool.shutdown(wait=False)
+
+        for (name, channel), future, aout in zip(channels, futures, aouts):
+            aout.setVoltage(0.0)
+            print('{0} (channel {1}) attached in {2:1.1f} ms'.format(name, channel, future.result() * 1000))
+        return aouts
+
+    def run(self, gain_yaw=1):
+        """
+        Loop forever listening for new messages on "fictrac" channel and output an
+        analog voltage proportional to heading rate for each new message
+        """
+        self.engine.set_transform(GainTransform(gain_yaw))
+        self.listen()
+
+    def listen(self, duration=None):
+        """
+        Listen on the "fictrac" channel and drive the outputs through the engine.
+        The experiment clock starts now; with a duration (s) the loop returns on the
+        first frame at or after it, or, should frames stop arriving, one second later.
+        That backstop is timed from the first data frame, as with FicTrac timestamps
+        the experiment time only starts counting there.
+        """
+        engine = self.engine
+        decode = self.decoder.decode
+        latency = self.latency
+        recorder = self.recorder
+        live_display = self.live_display
+        motion_filter = self.motion_filter
+        arena = self.arena
+        # the per-frame hook is only called when a subclass overrides it
+        on_frame = self.on_frame if type(self).on_frame is not AoutRunner.on_frame else None
+        clock = time.perf_counter_ns
+        experiment_time = self.clock.elapsed_ns
+        self.end_ns = None if duration is None else seconds_to_ns(duration)
+        end_ns = sys.maxsize if self.end_ns is None else self.end_ns
+        timed = self.end_ns is not None
+        self.handle_reset()
+        status = self.status if self.print else None
+        if status is not None:
+            status.start()
+
+        try:
+            for message in self.messages():
+                if latency is not None:
+                    t_receive = clock()
+
+                # New message from fictrac - decode into a frame object
+                try:
+                    data = decode(message)
+                except TypeError:
+                    continue
+
+                # Take action based on message type
+                if data.type == 'reset':
+                    # This is a reset message which indicates that FicTrac has been restarted
+                    self.handle_reset()
+                    continue
+
+                # This is a Data message
+                if latency is not None:
+                    t_decode = clock()
+                time_ns = experiment_time(data.timestamp)
+                if timed and self._watchdog is None:
+                    self.start_watchdog(time_ns)
+                volt_yaw, volt_x, volt_yaw_gain, volt_y = engine.update(data, time_ns)
+
+                if latency is None:
+                    self.aout_yaw.setVoltage(volt_yaw)
+                    self.aout_x.setVoltage(volt_x)
+                    self.aout_yaw_gain.setVoltage(volt_yaw_gain)
+                    self.aout_y.setVoltage(volt_y)
+                else:
+                    t_compute = clock()
+                    self.aout_yaw.setVoltage(volt_yaw)
+                    t_yaw = clock()
+                    self.aout_x.setVoltage(volt_x)
+                    t_x = clock()
+                    self.aout_yaw_gain.setVoltage(volt_yaw_gain)
+                    t_yaw_gain = clock()
+                    self.aout_y.setVoltage(volt_y)
+                    latency.record_frame(t_receive, t_decode, t_compute, (t_yaw, t_x, t_yaw_gain, clock()))
+
+                if motion_filter is not None:
+                    self.aout_vel.setVoltage(motion_filter.update(data, time_ns))
+
+                if arena is not None:
+                    for event, region in arena.update(data.posx, data.posy):
+                        self.on_region(event, region, time_ns)
+
+                if on_frame is not None:
+                    on_frame(data, time_ns)
+
+                if recorder is not None:
+                    recorder.record(data, time_ns, volt_yaw, volt_x, volt_yaw_gain, volt_y,
+                                    engine.heading_gain_adjusted, engine.transform.block)
+
+                if live_display is not None:
+                    live_display.push(data.posx, data.posy, data.heading)
+
+                # Publish the latest values to the status display thread
+                if status is not None:
+                    status.update((data.frame, time_ns / 1e9, engine.heading, volt_yaw, engine.wrapped_intx, volt_x,
+                                   engine.heading_gain_adjusted, volt_yaw_gain, engine.wrapped_inty, volt_y, engine.velheading))
+
+                if time_ns >= end_ns:
+                    self.pubsub.unsubscribe()
+                    break
+        finally:
+            self.close()
+
+    def handle_reset(self):
+        """
+        Restart the experiment clock and the block schedule, e.g. when FicTrac is restarted
+        """
+        self.time_start = time.time()
+        self.clock.reset()
+        self.engine.transform.reset()
+        if self.motion_filter is not None:
+            self.motion_filter.reset()
+        if self.arena is not None:
+            self.arena.reset()
+        # the watchdog is restarted on the first data frame after the reset
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        self.on_reset()
+
+    def start_watchdog(self, time_ns):
+        """
+        Backstop so the loop ends on time even if no frame arrives after end_ns: stops
+        listening one second after end_ns, counted from a frame at experiment time time_ns
+        """
+        self._watchdog = threading.Timer((self.end_ns - time_ns) / 1e9 + 1.0, self.pubsub.unsubscribe)
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def messages(self):
+        """
+        Payloads of the messages on the "fictrac" channel
+        """
+        if self.param['latest_frame_only']:
+            return self.latest_messages()
+        return self.pubsub.listen()
+
+    def message_batches(self):
+        """
+        Lists of all the messages queued on the "fictrac" channel, waiting for at least one
+        """
+        pubsub = self.pubsub
+        while pubsub.subscribed:
+            batch = pubsub.drain()
+            if batch:
+                yield batch
+
+    def latest_messages(self):
+        """
+        Newest message of each batch. The older data frames are dropped from the
+        outputs but still added to the accumulators, so accum_heading stays correct.
+        """
+        engine = self.engine
+        decode = self.decoder.decode
+        for batch in self.message_batches():
+            for message in batch[:-1]:
+                data = decode(message)
+                if data.type == 'reset':
+                    self.handle_reset()
+                else:
+                    engine.accumulate(data)
+                    self.frames_dropped += 1
+            yield batch[-1]
+
+    def close(self):
+        """
+        Stop the status display, the feedback transform (noise threads) and the
+        background writers (if any), report how many updates were coalesced, and the
+        latency histograms when latency_report is on. Closes the live display and the
+        session recorder, if any.
+        """
+        self.status.stop()
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        self.engine.transform.close()
+        for name, aout in self.channels():
+            if isinstance(aout, CoalescingWriter):
+                aout.close()
+                print('{0}: {1} written, {2} coalesced'.format(name, aout.written, aout.coalesced))
+        if self.param['latest_frame_only']:
+            print('frames dropped: {0}'.format(self.frames_dropped))
+        if self.latency is not None:
+            self.latency.report()
+        if self.live_display is not None:
+            self.live_display.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            print('recorded {0} frames to {1}'.format(self.recorder.recorded, self.recorder.file))
+
+    def channels(self):
+        return list(self.aouts.items())
+
+    def extra_channels(self):
+        """
+        (name, channel) pairs of the subclass's own outputs, opened with the four base
+        channels and then found in self.aouts by name. Runs before the subclass's
+        __init__ body, so it can only use self.param.
+        """
+        return []
+
+    def on_reset(self):
+        """
+        Called when FicTrac sends a reset message
+        """
+        pass
+
+    def on_frame(self, data, time_ns):
+        """
+        Called for every data frame, after the four channels are written
+        """
+        pass
+
+    def on_region(self, event, region, time_ns):
+        """
+        Called when the fly enters or exits (event 'enter' or 'exit') an arena region
+        (arena_file only); prints the event
+        """
+        print('{0:1.3f} s: {1} {2}{3}'.format(time_ns / 1e9, event, region.name,
+                                               '' if region.kind is None else ' ({0})'.format(region.kind)))
+
+    def noise_transform(self, gain_yaw=1):
+        """
+        NoiseTransform with the noise settings in param. The seed is printed so the
+        session can be reproduced, and stored in param['noise_seed'].
+        """
+        param = self.param
+        transform = NoiseTransform(gain_yaw, param['noise_clip'], param['noise_sigma'], param['noise_seed'], param['noise_mode'])
+        print('noise seed: {0}'.format(transform.noise.seed))
+        self.record_param(noise_seed=transform.noise.seed)
+        return transform
+
+    def record_param(self, **items):
+        """
+        Set items in param and in the param saved with the session recording (if any),
+        for settings only known once the run starts, such as drawn noise seeds
+        """
+        self.param.update(items)
+        if self.recorder is not None:
+            self.recorder.save_param(self.param)
+
+    def format_status(self, snapshot):
+        """
+        Status line for one snapshot (runs on the status display thread)
+        """
+        return ('frame: {0}  time: {1:1.3f}  yaw: {2:1.3f} ({3:1.3f} V)  int x: {4:1.3f} ({5:1.3f} V)  '
+                'yaw gain adjusted: {6:1.3f} ({7:1.3f} V)  int y: {8:1.3f} ({9:1.3f} V)  velheading: {10:1.3f}').format(*snapshot)
+
+
+# Utilities
+# ---------------------------------------------------------------------------------------
+def describe_error(error):
+    """
+    Readable message for an exception, using the phidget error details when available
+    """
+    if isinstance(error, PhidgetException):
+        return '{0} (0x{1:x})'.format(error.details or error.description, int(error.code))
+    return str(error) or type(error).__name__
@@ -0,0 +1,83 @@
+from __future__ import print_function
+import threading
+import time
+
+
+class CoalescingWriter(object):
+    """
+    Non-blocking voltage writer for one phidget output channel.
+
+    setVoltage() only stores the newest value and returns; a background thread sends
+    it to the channel. If a new value arrives before the previous one was sent, the
+    stale value is dropped and counted as coalesced, so a slow USB write never delays
+    reading the next fictrac message.
+
+    With latency set to a LatencyRecorder, each channel write is timed on the writer
+    thread and recorded with latency.record_write().
+    """
+
+    def __init__(self, aout, name=''):
+        self.aout = aout
+        self.name = name
+        self.written = 0
+        self.coalesced = 0
+        self.error = None
+        self.latency = None
+
+        self._pending = None
+        self._running = True
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name='aout-writer-{0}'.format(name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def setVoltage(self, value):
+        """
+        Queue value for output, replacing any value that has not been sent yet
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        with self._cond:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = value
+            self._cond.notify()
+
+    def _loop(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while self._pending is None and self._running:
+                    cond.wait()
+                if self._pending is None:
+                    return
+                value = self._pending
+                self._pending = None
+            try:
+                latency = self.latency
+                if latency is None:
+                    self.aout.setVoltage(value)
+                else:
+                    t0 = time.perf_counter_ns()
+                    self.aout.setVoltage(value)
+                    latency.record_write(self.name, time.perf_counter_ns() - t0)
+                self.written += 1
+            except Exception as error:
+                self.error = error
+
+    def close(self, timeout=1.0):
+        """
+        Send the last pending value and stop the writer thread
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {'written': self.written, 'coalesced': self.coalesced}
+
+    def __getattr__(self, attr):
+        # Everything other than setVoltage goes straight to the wrapped channel
+        return getattr(self.aout, attr)
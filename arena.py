@@ -0,0 +1,309 @@
+from __future__ import print_function
+import math
+import time
+import numpy as np
+
+try:
+    from .protocol import load_config
+except ImportError:
+    from protocol import load_config
+
+
+class Region(object):
+    """
+    Named polygonal region of an arena (odor zone, heat zone, reward patch, ...).
+    vertices is an (n, 2) sequence of x, y; the polygon is closed implicitly.
+    """
+
+    def __init__(self, name, vertices, kind=None):
+        self.name = name
+        self.kind = kind
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        if self.vertices.ndim != 2 or self.vertices.shape[1] != 2 or len(self.vertices) < 3:
+            raise ValueError('region {0!r} needs at least 3 (x, y) vertices'.format(name))
+
+    @classmethod
+    def rect(cls, name, x0, y0, x1, y1, kind=None):
+        return cls(name, [(x0, y0), (x1, y0), (x1, y1), (x0, y1)], kind)
+
+    @classmethod
+    def circle(cls, name, x, y, radius, kind=None, n=64):
+        angle = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        return cls(name, np.column_stack((x + radius * np.cos(angle), y + radius * np.sin(angle))), kind)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Region from a dict with a name, optional kind and one of polygon [[x, y], ...],
+        rect [x0, y0, x1, y1] or circle [x, y, radius]
+        """
+        name = spec.get('name')
+        kind = spec.get('kind')
+        if 'polygon' in spec:
+            return cls(name, spec['polygon'], kind)
+        if 'rect' in spec:
+            return cls.rect(name, *spec['rect'], kind=kind)
+        if 'circle' in spec:
+            return cls.circle(name, *spec['circle'], kind=kind)
+        raise ValueError('region {0!r} has no polygon, rect or circle'.format(name))
+
+    @property
+    def edges(self):
+        """
+        (n, 4) array of the polygon edges as x1, y1, x2, y2
+        """
+        return np.hstack((self.vertices, np.roll(self.vertices, -1, axis=0)))
+
+    def contains(self, x, y):
+        """
+        Point in polygon (crossing number), over scalars or arrays
+        """
+        return points_in_polygon(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), self.edges)
+
+    def __repr__(self):
+        return 'Region({0!r}, kind={1!r}, {2} vertices)'.format(self.name, self.kind, len(self.vertices))
+
+
+class Arena(object):
+    """
+    Set of regions with a uniform-grid index for classifying positions.
+
+    The bounding box of the regions is split into cell_size cells (by default about
+    256 along the longer side). For each cell the index holds the regions that cover
+    it completely and, for the regions whose edges cross it, whether the cell centre
+    is inside and the few edges crossing the cell. A position is then classified in
+    constant time: one cell lookup, plus for boundary cells the parity of the local
+    edges crossed on the way from the cell centre to the position. regions_at()
+    returns the frozenset of the indices of the regions containing a position.
+    """
+
+    empty = frozenset()
+
+    def __init__(self, regions, cell_size=None):
+        self.regions = list(regions)
+        if not self.regions:
+            raise ValueError('arena has no regions')
+        vertices = np.vstack([region.vertices for region in self.regions])
+        self.x0, self.y0 = vertices.min(axis=0)
+        x1, y1 = vertices.max(axis=0)
+        if cell_size is None:
+            cell_size = max(x1 - self.x0, y1 - self.y0) / 256.0
+        self.cell_size = float(cell_size)
+        self.inv_cell = 1.0 / self.cell_size
+        self.nx = int(math.floor((x1 - self.x0) * self.inv_cell)) + 1
+        self.ny = int(math.floor((y1 - self.y0) * self.inv_cell)) + 1
+        self._cells = self._build()
+
+    def _build(self):
+        nx, ny, size = self.nx, self.ny, self.cell_size
+        centre_x = self.x0 + (np.arange(nx) + 0.5) * size
+        centre_y = self.y0 + (np.arange(ny) + 0.5) * size
+        full = {}
+        partial = {}
+        for index, region in enumerate(self.regions):
+            edges = region.edges
+            crossing = {}
+            for e, edge in enumerate(edges):
+                for cell in self._edge_cells(edge):
+                    crossing.setdefault(cell, []).append(e)
+            # cells of the region's bounding box that no edge crosses are all in or all out
+            (vx0, vy0), (vx1, vy1) = region.vertices.min(axis=0), region.vertices.max(axis=0)
+            ix0, iy0 = self._cell(vx0, vy0)
+            ix1, iy1 = self._cell(vx1, vy1)
+            gx, gy = np.meshgrid(centre_x[ix0:ix1 + 1], centre_y[iy0:iy1 + 1])
+            inside = points_in_polygon(gx, gy, edges)
+            for iy, ix in zip(*[i.tolist() for i in np.nonzero(inside)]):
+                cell = (iy + iy0, ix + ix0)
+                if cell not in crossing:
+                    full.setdefault(cell, []).append(index)
+            for (iy, ix), edge_index in crossing.items():
+                partial.setdefault((iy, ix), []).append(
+                    (index, bool(inside[iy - iy0, ix - ix0]), float(centre_x[ix]), float(centre_y[iy]),
+                     tuple(tuple(edge) for edge in edges[edge_index].tolist())))
+
+        # share one frozenset per distinct set of covering regions
+        interned = {(): Arena.empty}
+        cells = [[(Arena.empty, ())] * nx for _ in range(ny)]
+        for cell in set(full) | set(partial):
+            key = tuple(full.get(cell, ()))
+            covering = interned.setdefault(key, frozenset(key))
+            cells[cell[0]][cell[1]] = (covering, tuple(partial.get(cell, ())))
+        return cells
+
+    def _cell(self, x, y):
+        ix = min(max(int(math.floor((x - self.x0) * self.inv_cell)), 0), self.nx - 1)
+        iy = min(max(int(math.floor((y - self.y0) * self.inv_cell)), 0), self.ny - 1)
+        return ix, iy
+
+    def _edge_cells(self, edge):
+        """
+        Cells an edge passes through: the cells of its bounding box that it actually crosses
+        """
+        ax, ay, bx, by = edge
+        ix0, iy0 = self._cell(min(ax, bx), min(ay, by))
+        ix1, iy1 = self._cell(max(ax, bx), max(ay, by))
+        ix, iy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+        ix = ix.ravel()
+        iy = iy.ravel()
+        left = self.x0 + ix * self.cell_size
+        bottom = self.y0 + iy * self.cell_size
+        # the edge crosses a cell unless all four corners are on the same side of it
+        side = [(bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+                for cx in (left, left + self.cell_size) for cy in (bottom, bottom + self.cell_size)]
+        side = np.array(side)
+        crossed = (side.min(axis=0) <= 0) & (side.max(axis=0) >= 0)
+        return zip(iy[crossed].tolist(), ix[crossed].tolist())
+
+    def regions_at(self, x, y):
+        """
+        Frozenset of the indices of the regions containing (x, y)
+        """
+        ix = math.floor((x - self.x0) * self.inv_cell)
+        iy = math.floor((y - self.y0) * self.inv_cell)
+        if not (0 <= ix < self.nx and 0 <= iy < self.ny):
+            return Arena.empty
+        covering, partial = self._cells[iy][ix]
+        if not partial:
+            return covering
+        inside = set(covering)
+        for index, centre_inside, cx, cy, edges in partial:
+            if centre_inside != (crossings(cx, cy, x, y, edges) & 1):
+                inside.add(index)
+        return frozenset(inside)
+
+    def names(self, indices):
+        return [self.regions[i].name for i in sorted(indices)]
+
+
+class ArenaTracker(object):
+    """
+    Follows the fly through an arena and emits region enter/exit events.
+
+    update(x, y) returns a tuple of ('enter' | 'exit', Region) events (empty when the
+    fly stays in the same regions) and calls on_enter(region) / on_exit(region) if given.
+    AoutRunner follows one every frame when its arena_file param is set.
+    """
+
+    def __init__(self, arena, on_enter=None, on_exit=None):
+        self.arena = arena
+        self.regions_at = arena.regions_at
+        self.on_enter = on_enter
+        self.on_exit = on_exit
+        self.reset()
+
+    def reset(self):
+        self.current = Arena.empty
+
+    def update(self, x, y):
+        regions = self.regions_at(x, y)
+        current = self.current
+        if regions is current or regions == current:
+            return ()
+        self.current = regions
+        all_regions = self.arena.regions
+        events = tuple([('exit', all_regions[i]) for i in sorted(current - regions)] +
+                       [('enter', all_regions[i]) for i in sorted(regions - current)])
+        for kind, region in events:
+            callback = self.on_enter if kind == 'enter' else self.on_exit
+            if callback is not None:
+                callback(region)
+        return events
+
+
+def load_arena(file):
+    """
+    Load an arena from a JSON or YAML file holding a mapping with a 'regions' list (see
+    Region.from_spec) and an optional 'cell_size'
+    """
+    spec = load_config(file)
+    return Arena([Region.from_spec(region) for region in spec['regions']], spec.get('cell_size'))
+
+
+# Utilities
+# ---------------------------------------------------------------------------------------
+def points_in_polygon(x, y, edges):
+    """
+    Crossing-number point in polygon test of arrays of points against (n, 4) edges
+    """
+    inside = np.zeros(np.shape(x), dtype=bool)
+    for x1, y1, x2, y2 in edges:
+        straddles = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= straddles & (x < x_cross)
+    return inside
+
+
+def crossings(ax, ay, bx, by, edges):
+    """
+    Number of edges properly crossed by the segment from (ax, ay) to (bx, by)
+    """
+    n = 0
+    dx = bx - ax
+    dy = by - ay
+    for x1, y1, x2, y2 in edges:
+        ex = x2 - x1
+        ey = y2 - y1
+        if (((ex * (ay - y1) - ey * (ax - x1)) > 0) != ((ex * (by - y1) - ey * (bx - x1)) > 0) and
+                ((dx * (y1 - ay) - dy * (x1 - ax)) > 0) != ((dx * (y2 - ay) - dy * (x2 - ax)) > 0)):
+            n += 1
+    return n
+
+
+def random_arena(n_regions=200, size=200.0, seed=0):
+    """
+    Arena of n_regions random circles and polygons, for benchmarking
+    """
+    rng = np.random.default_rng(seed)
+    regions = []
+    for i in range(n_regions):
+        x, y = rng.uniform(0, size, 2)
+        radius = rng.uniform(2.0, 10.0)
+        if i % 2:
+            regions.append(Region.circle('circle{0}'.format(i), x, y, radius, kind='odor'))
+        else:
+            angle = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(5, 12)))
+            r = radius * rng.uniform(0.5, 1.0, len(angle))
+            regions.append(Region('polygon{0}'.format(i), np.column_stack((x + r * np.cos(angle), y + r * np.sin(angle))),
+                                  kind='heat'))
+    return Arena(regions)
+
+
+def benchmark(n=100000, n_regions=200):
+    """
+    Time the grid index against a linear scan over every region for random positions
+    """
+    arena = random_arena(n_regions)
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0, 200.0, n).tolist()
+    y = rng.uniform(0, 200.0, n).tolist()
+    regions_at = arena.regions_at
+    t0 = time.perf_counter()
+    found = [regions_at(x[i], y[i]) for i in range(n)]
+    t_grid = time.perf_counter() - t0
+
+    # linear scan: bounding-box reject, then a crossing-number test, region by region
+    boxes = [tuple(region.vertices.min(axis=0).tolist() + region.vertices.max(axis=0).tolist())
+             for region in arena.regions]
+    edges = [region.edges.tolist() for region in arena.regions]
+
+    def scan(px, py):
+        inside = []
+        for j, (bx0, by0, bx1, by1) in enumerate(boxes):
+            if bx0 <= px <= bx1 and by0 <= py <= by1:
+                odd = False
+                for x1, y1, x2, y2 in edges[j]:
+                    if (y1 > py) != (y2 > py) and px < x1 + (py - y1) * (x2 - x1) / (y2 - y1):
+                        odd = not odd
+                if odd:
+                    inside.append(j)
+        return frozenset(inside)
+
+    t0 = time.perf_counter()
+    scanned = [scan(x[i], y[i]) for i in range(n)]
+    t_scan = time.perf_counter() - t0
+    same = found == scanned
+    print('{0} regions, {1}x{2} grid'.format(n_regions, arena.nx, arena.ny))
+    print('{0:<24}{1:>10.2f} us/frame'.format('grid index', t_grid / n * 1e6))
+    print('{0:<24}{1:>10.2f} us/frame  ({2:1.0f}x)'.format('linear scan', t_scan / n * 1e6, t_scan / t_grid))
+    print('identical: {0}'.format(same))
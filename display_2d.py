@@ -6,6 +6,11 @@ import matplotlib.patches as patches
 import matplotlib.transforms as transforms
 import math
 
+try:
+    from .path_lod import PathPyramid
+except ImportError:
+    from path_lod import PathPyramid
+
 PLT_REQUIRES_PAUSE = matplotlib.__version__ < '1.5.1'
 PLT_PAUSE = 0.0001
 
@@ -16,6 +21,7 @@ class Display(object):
         'display_xlim': (-20, 20), # relative to fly
         'display_ylim': (-20, 20),
         'fly_color': 'k',
+        'path_vertices_per_pixel': 4, # path vertices drawn per pixel of axes width
         }
 
     def __init__(self, param=default_param):
@@ -24,8 +30,11 @@ class Display(object):
         self.fly_color = param['fly_color']
         self.xlim_init = param['display_xlim']
         self.ylim_init = param['display_ylim']
+        self.path_vertices_per_pixel = param.get('path_vertices_per_pixel', 4)
         # some additional plotting parameters
         self.margin = 2.0
+        self.stim_on = False
+        self.stim_color = 'r'
 
         # start plot!
         plt.ion()
@@ -34,8 +43,11 @@ class Display(object):
 
         # prep all stim items possible, keeping them hidden
         self.pos_line, = plt.plot([0, 1], [0, 1], self.fly_color)
-        self.pos_arrow = plt.quiver(0, 0, 1, 0, cmap=cm.get_cmap('Blues', 20))
+        self.pos_arrow = plt.quiver(0, 0, 1, 0, cmap=plt.get_cmap('Blues', 20))
         self.text = plt.text(.8, .9,'stim off', horizontalalignment='center', verticalalignment='center', transform = self.ax.transAxes)
+        self.stim_arrow = plt.quiver(0, 0, 1, 0, color=self.stim_color)
+        self.stim_type = None
+        self.set_stim_enabled(False)
         plt.axis('equal')
         plt.grid('on')
         plt.xlabel('x pos')
@@ -54,8 +66,25 @@ class Display(object):
             plt.pause(PLT_PAUSE)
 
     def draw_path(self, data):
-        self.pos_line.set_xdata(data.posx_list)
-        self.pos_line.set_ydata(data.posy_list)
+        # only the points added since the last call go into the level of detail pyramid
+        n = len(self.path_lod)
+        if len(data.posx_list) < n:
+            self.path_lod = PathPyramid()
+            n = 0
+        self.add_points(data.posx_list[n:], data.posy_list[n:])
+        self.draw_fly(data)
+
+    def add_points(self, posx, posy):
+        """
+        Extend the path with new positions
+        """
+        self.path_lod.extend(posx, posy)
+        self.draw_path_lod()
+
+    def draw_fly(self, data):
+        """
+        Move the heading arrow to the fly's current position (data.posx, data.posy, data.heading)
+        """
         new_position = numpy.array([data.posx, data.posy])
         self.pos_arrow.set_offsets(new_position)
         self.pos_arrow.set_UVC(math.cos(math.radians(data.heading)), math.sin(math.radians(data.heading)))
@@ -64,16 +93,48 @@ class Display(object):
         else:
             self.pos_arrow.set_color(self.fly_color)
 
+    def set_stim_enabled(self, enabled):
+        """
+        Show or hide the stimulus arrow
+        """
+        self.stim_enabled = enabled
+        self.stim_arrow.set_visible(enabled)
+
+    def set_stim_type(self, stim_type):
+        """
+        Label the plot with the stimulus (experiment) type
+        """
+        self.stim_type = stim_type
+        self.text.set_text(stim_type)
+
+    def draw_stim(self, x, y, heading):
+        """
+        Move the stimulus arrow to (x, y), pointing along heading (deg)
+        """
+        self.stim_arrow.set_offsets(numpy.array([x, y]))
+        self.stim_arrow.set_UVC(math.cos(math.radians(heading)), math.sin(math.radians(heading)))
+
+    def draw_path_lod(self):
+        """
+        Set the path line to the part of the path in the current axis range, with only
+        as many vertices as the axes width needs
+        """
+        max_vertices = int(self.path_vertices_per_pixel * self.ax.bbox.width)
+        x, y = self.path_lod.view(self.ax.get_xlim(), self.ax.get_ylim(), max_vertices)
+        self.pos_line.set_data(x, y)
+
     def set_xylim(self, data):
         self.xlim = data.posx + self.xlim_init[0], data.posx + self.xlim_init[1]
         self.ylim = data.posy + self.ylim_init[0], data.posy + self.ylim_init[1]
         self.ax.set_xlim(*self.xlim)
         self.ax.set_ylim(*self.ylim)
+        self.draw_path_lod()
 
     
     def reset(self):
         self.xlim = self.xlim_init
         self.ylim = self.ylim_init
+        self.path_lod = PathPyramid()
         self.pos_line.set_xdata([])
         self.pos_line.set_ydata([])
         self.pos_arrow.set_offsets(numpy.array([0, 0]))
@@ -0,0 +1,74 @@
+from __future__ import print_function
+import sys
+import time
+import numpy as np
+
+
+class ExperimentClock(object):
+    """
+    Monotonic, drift-free experiment time in integer nanoseconds.
+
+    Frames carrying a FicTrac timestamp (ms, non-zero) are timed from the first
+    timestamp after reset(), so a recorded session replays with exactly the same
+    times. Otherwise the time is time.perf_counter_ns() since reset(), which unlike
+    time.time() never jumps with wall-clock adjustments.
+    """
+
+    def __init__(self, use_frame_timestamps=True):
+        self.use_frame_timestamps = use_frame_timestamps
+        self.reset()
+
+    def reset(self):
+        self.start_ns = time.perf_counter_ns()
+        self.timestamp_start = None
+
+    def elapsed_ns(self, timestamp=0.0):
+        """
+        Experiment time of a frame with the given FicTrac timestamp (ms, 0 if unknown)
+        """
+        if timestamp and self.use_frame_timestamps:
+            if self.timestamp_start is None:
+                self.timestamp_start = timestamp
+            return int(round((timestamp - self.timestamp_start) * 1e6))
+        return time.perf_counter_ns() - self.start_ns
+
+
+class BlockTimer(object):
+    """
+    Block index for a precomputed list of block boundaries (s).
+
+    The boundaries are converted to integer ns once; block() then only compares the
+    frame time against the next boundary, so each frame costs O(1) whatever the
+    number of blocks. Times must not go backwards between reset() calls. A frame at
+    exactly a boundary belongs to the block starting there.
+    """
+
+    def __init__(self, boundaries):
+        self.boundaries_ns = np.array([int(round(b * 1e9)) for b in boundaries], dtype=np.int64)
+        self._next = [int(b) for b in self.boundaries_ns] + [sys.maxsize]
+        self.reset()
+
+    def reset(self):
+        self.index = 0
+        self.next_ns = self._next[0]
+
+    def block(self, time_ns):
+        while time_ns >= self.next_ns:
+            self.index += 1
+            self.next_ns = self._next[self.index]
+        return self.index
+
+    def blocks(self, time_ns):
+        """
+        Vectorized block() over an array of times (ns), for offline replay
+        """
+        return np.searchsorted(self.boundaries_ns, time_ns, side='right')
+
+
+def seconds_to_ns(seconds):
+    """
+    Convert seconds (scalar or array) to integer ns
+    """
+    if np.ndim(seconds):
+        return np.round(np.asarray(seconds, dtype=np.float64) * 1e9).astype(np.int64)
+    return int(round(seconds * 1e9))
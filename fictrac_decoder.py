@@ -0,0 +1,174 @@
+from __future__ import print_function
+import json
+import time
+from typing import Union
+import numpy as np
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Sample FicTrac v2 message as published on the redis 'fictrac' channel
+SAMPLE_MESSAGE = b'{"deltaheading":421.411575876916,"frame":2729,"heading":23.9414329813745,"intx":3672.85974846204,"inty":-17093.2855767625,"posx":-177.638739989378,"posy":11.1943596672353,"type":"data","velx":-5.82186481311745,"vely":-10.1414673377749}'
+
+FRAME_FIELDS = ('type', 'frame', 'heading', 'deltaheading', 'intx', 'inty', 'posx', 'posy', 'velx', 'vely', 'timestamp')
+
+# NumPy record layout of a data frame (the 'type' field is dropped)
+frame_dtype = np.dtype([
+    ('frame', np.int64),
+    ('heading', np.float64),
+    ('deltaheading', np.float64),
+    ('intx', np.float64),
+    ('inty', np.float64),
+    ('posx', np.float64),
+    ('posy', np.float64),
+    ('velx', np.float64),
+    ('vely', np.float64),
+    ('timestamp', np.float64),
+])
+
+
+class FicTracFrame(object):
+    """
+    One FicTrac v2 message, with the known fields as slots instead of dict keys.
+    timestamp (FicTrac frame time, ms) is 0.0 when the publisher does not send it.
+    """
+
+    __slots__ = FRAME_FIELDS
+
+    def __init__(self, type='data', frame=0, heading=0.0, deltaheading=0.0, intx=0.0, inty=0.0,
+                 posx=0.0, posy=0.0, velx=0.0, vely=0.0, timestamp=0.0):
+        self.type = type
+        self.frame = frame
+        self.heading = heading
+        self.deltaheading = deltaheading
+        self.intx = intx
+        self.inty = inty
+        self.posx = posx
+        self.posy = posy
+        self.velx = velx
+        self.vely = vely
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, data):
+        get = data.get
+        return cls(get('type', 'data'), get('frame', 0), get('heading', 0.0), get('deltaheading', 0.0),
+                   get('intx', 0.0), get('inty', 0.0), get('posx', 0.0), get('posy', 0.0),
+                   get('velx', 0.0), get('vely', 0.0), get('timestamp', 0.0))
+
+    def __repr__(self):
+        return 'FicTracFrame({0})'.format(', '.join('{0}={1!r}'.format(f, getattr(self, f)) for f in FRAME_FIELDS))
+
+
+if msgspec is not None:
+    class MsgspecFrame(msgspec.Struct):
+        """
+        FicTracFrame decoded directly by msgspec (same attributes, unknown fields ignored).
+        frame takes an int or a float, as it does with the json backends.
+        """
+        type: str = 'data'
+        frame: Union[int, float] = 0
+        heading: float = 0.0
+        deltaheading: float = 0.0
+        intx: float = 0.0
+        inty: float = 0.0
+        posx: float = 0.0
+        posy: float = 0.0
+        velx: float = 0.0
+        vely: float = 0.0
+        timestamp: float = 0.0
+
+
+class FicTracDecoder(object):
+    """
+    Decode FicTrac messages into frame objects with attribute access.
+
+    Uses the fastest installed backend: msgspec (decodes straight into a struct),
+    orjson, or the stdlib json module. Like json.loads, decode() raises TypeError for
+    payloads that are not bytes or str (e.g. redis subscribe confirmations).
+    """
+
+    backends = ('msgspec', 'orjson', 'json')
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+        if backend not in self.backends:
+            raise ValueError('unknown decoder backend {0}'.format(backend))
+        if (backend == 'msgspec' and msgspec is None) or (backend == 'orjson' and orjson is None):
+            raise ImportError('{0} is not installed'.format(backend))
+        self.backend = backend
+
+        if backend == 'msgspec':
+            self._decode = msgspec.json.Decoder(MsgspecFrame).decode
+        elif backend == 'orjson':
+            loads = orjson.loads
+            from_dict = FicTracFrame.from_dict
+            self._decode = lambda message: from_dict(loads(message))
+        else:
+            loads = json.loads
+            from_dict = FicTracFrame.from_dict
+            self._decode = lambda message: from_dict(loads(message))
+
+    def decode(self, message):
+        if not isinstance(message, (bytes, str, bytearray, memoryview)):
+            raise TypeError('message must be bytes or str, not {0}'.format(type(message).__name__))
+        return self._decode(message)
+
+
+def to_record(frames):
+    """
+    Pack a sequence of data frames into a NumPy structured array with frame_dtype
+    """
+    records = np.empty(len(frames), dtype=frame_dtype)
+    for i, f in enumerate(frames):
+        records[i] = (f.frame, f.heading, f.deltaheading, f.intx, f.inty, f.posx, f.posy, f.velx, f.vely, f.timestamp)
+    return records
+
+
+def benchmark(n=200000, message=SAMPLE_MESSAGE):
+    """
+    Time json.loads + dict lookups (the original loop) against each available decoder backend
+    """
+    def run_dict():
+        loads = json.loads
+        t0 = time.perf_counter()
+        for _ in range(n):
+            data = loads(message)
+            if data['type'] == 'reset':
+                continue
+            data['heading'], data['intx'], data['inty'], data['velx'], data['vely'], data['deltaheading'], data['frame']
+        return time.perf_counter() - t0
+
+    def run_decoder(decoder):
+        decode = decoder.decode
+        t0 = time.perf_counter()
+        for _ in range(n):
+            data = decode(message)
+            if data.type == 'reset':
+                continue
+            data.heading, data.intx, data.inty, data.velx, data.vely, data.deltaheading, data.frame
+        return time.perf_counter() - t0
+
+    baseline = run_dict()
+    print('{0:<24}{1:>10.0f} ns/msg'.format('json.loads + dict', baseline / n * 1e9))
+    for backend in FicTracDecoder.backends:
+        try:
+            decoder = FicTracDecoder(backend)
+        except ImportError:
+            print('{0:<24}{1:>10}'.format('decoder ' + backend, 'n/a'))
+            continue
+        elapsed = run_decoder(decoder)
+        print('{0:<24}{1:>10.0f} ns/msg  ({2:1.2f}x)'.format('decoder ' + backend, elapsed / n * 1e9, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    benchmark()
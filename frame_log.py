@@ -0,0 +1,122 @@
+from __future__ import print_function
+import os
+import json
+import numpy as np
+
+try:
+    from .session_recorder import record_dtype, create_session, append_records
+except ImportError:
+    from session_recorder import record_dtype, create_session, append_records
+
+
+# One logged frame. valid is written together with the rest of the record, so after a
+# crash the log ends at the first record with valid == 0.
+log_dtype = np.dtype([
+    ('frame', np.int64),
+    ('time_ns', np.int64), # experiment time (ns)
+    ('timestamp', np.float64), # FicTrac timestamp (ms)
+    ('posx', np.float64),
+    ('posy', np.float64),
+    ('heading', np.float64),
+    ('intx', np.float64),
+    ('inty', np.float64),
+    ('deltaheading', np.float64),
+    ('velx', np.float64),
+    ('vely', np.float64),
+    ('volt_yaw', np.float64),
+    ('volt_x', np.float64),
+    ('volt_yaw_gain', np.float64),
+    ('volt_y', np.float64),
+    ('stim_heading', np.float64),
+    ('block', np.int32),
+    ('valid', np.uint8),
+])
+
+
+class FrameLog(object):
+    """
+    Crash-safe binary frame log.
+
+    The file is a .npy array of capacity log_dtype records, pre-allocated (sparse on
+    disk) and memory-mapped when the log is opened. record() writes each frame
+    straight into its slot of the mapped structured array, so there is no buffering
+    or copy in between: once record() returns the data is in the page cache and the
+    OS writes it out even if the process dies. Frames beyond capacity are counted in
+    overflow and not logged. The param dict is saved next to the log as file + '.json'.
+    Has the same record()/close() interface as session_recorder.SessionRecorder.
+    """
+
+    def __init__(self, file, param=None, capacity=10000000):
+        self.file = file
+        self.capacity = int(capacity)
+        self.recorded = 0
+        self.overflow = 0
+        self.save_param(param)
+        self.log = np.lib.format.open_memmap(file, mode='w+', dtype=log_dtype, shape=(self.capacity,))
+
+    def save_param(self, param):
+        """
+        Rewrite the file + '.json' param, e.g. once the noise seeds are known
+        """
+        with open(self.file + '.json', 'w') as f:
+            json.dump(param or {}, f, default=str)
+
+    def record(self, data, time_ns, volt_yaw, volt_x, volt_yaw_gain, volt_y, stim_heading, block):
+        """
+        Write one data frame (a FicTracFrame) at experiment time time_ns with its output voltages
+        """
+        i = self.recorded
+        if i < self.capacity:
+            self.log[i] = (data.frame, time_ns, data.timestamp, data.posx, data.posy, data.heading, data.intx,
+                           data.inty, data.deltaheading, data.velx, data.vely, volt_yaw, volt_x, volt_yaw_gain,
+                           volt_y, stim_heading, block, 1)
+            self.recorded = i + 1
+        else:
+            self.overflow += 1
+
+    def close(self):
+        self.log.flush()
+        self.log = None
+        if self.overflow:
+            print('frame log full: {0} frames not logged'.format(self.overflow))
+
+
+def load_frame_log(file):
+    """
+    Records of a frame log (memory-mapped, read only), up to the last complete record
+    """
+    log = np.load(file, mmap_mode='r')
+    # records are written in order, so the valid flags are all 1 then all 0
+    lo, hi = 0, len(log)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if log[mid]['valid']:
+            lo = mid + 1
+        else:
+            hi = mid
+    return log[:lo]
+
+
+def frame_log_to_hdf5(file, h5_file=None, chunk_size=100000):
+    """
+    Convert a frame log into a session file in the plot_pos.Figure2D layout (see
+    session_recorder), using the saved param for the jsonparam attribute. The log is
+    read chunk_size records at a time. Returns the name of the HDF5 file.
+    """
+    h5_file = os.path.splitext(file)[0] + '.h5' if h5_file is None else h5_file
+    param = None
+    if os.path.exists(file + '.json'):
+        with open(file + '.json') as f:
+            param = json.load(f)
+    log = load_frame_log(file)
+    h5 = create_session(h5_file, param, min(chunk_size, max(len(log), 1)))
+    try:
+        for start in range(0, len(log), chunk_size):
+            chunk = log[start:start + chunk_size]
+            records = np.empty(len(chunk), dtype=record_dtype)
+            for name in record_dtype.names:
+                records[name] = chunk['time_ns'] / 1e9 if name == 'time' else chunk[name]
+            append_records(h5, start, records)
+    finally:
+        h5.close()
+    return h5_file
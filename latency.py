@@ -0,0 +1,169 @@
+from __future__ import print_function
+import sys
+import signal
+import threading
+from collections import OrderedDict
+
+
+class LatencyHistogram(object):
+    """
+    HDR-style latency histogram in fixed memory.
+
+    Values (in ns) are counted in log-linear buckets: each power of two is split into
+    2**sub_bucket_bits linear sub-buckets, so the relative error of any percentile is
+    below 2**-sub_bucket_bits whatever the number of samples. Values above
+    2**max_value_bits ns land in the last bucket.
+    """
+
+    def __init__(self, sub_bucket_bits=7, max_value_bits=40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.max_index = (max_value_bits - sub_bucket_bits + 1) * self.sub_bucket_count - 1
+        self.counts = [0] * (self.max_index + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def index(self, value):
+        """
+        Bucket index of value (ns)
+        """
+        if value < self.sub_bucket_count:
+            return max(value, 0)
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        index = (shift + 1) * self.sub_bucket_count + (value >> shift) - self.sub_bucket_count
+        return min(index, self.max_index)
+
+    def value_at(self, index):
+        """
+        Highest value (ns) counted in bucket index
+        """
+        exponent, sub = divmod(index, self.sub_bucket_count)
+        if exponent == 0:
+            return sub
+        return ((self.sub_bucket_count + sub + 1) << (exponent - 1)) - 1
+
+    def record(self, value):
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, p):
+        """
+        Value (ns) at or below which p percent of the recorded values fall
+        """
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.value_at(index), self.max)
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / float(self.count)
+
+
+class LatencyRecorder(object):
+    """
+    Per-frame latency instrumentation for the analog output loop.
+
+    Each frame is timestamped (time.perf_counter_ns) at message receive, after json
+    decode, after the transform compute and after each channel write. The stage
+    latencies go into one LatencyHistogram each; 'total' runs from receive to the
+    last channel write.
+
+    With async_write the loop only hands each voltage to a CoalescingWriter, so its
+    stages are named enqueue_<channel> and 'total' ends at the last enqueue; the
+    phidget writes themselves are timed on the writer threads (record_write()) as
+    write_<channel>. The report is printed by report(), e.g. at shutdown, or on
+    SIGUSR1 once install_signal() has been called. The signal handler only flags the
+    request; the report is printed after the next recorded frame, so the handler
+    never waits on the lock held by record_frame().
+    """
+
+    channels = ('yaw', 'x', 'yaw_gain', 'y')
+
+    def __init__(self, async_write=False):
+        self.async_write = async_write
+        self.frame_stages = tuple(('enqueue_' if async_write else 'write_') + name for name in self.channels)
+        stages = ('decode', 'compute') + self.frame_stages + ('total',)
+        if async_write:
+            stages += tuple('write_' + name for name in self.channels)
+        self.histograms = OrderedDict((stage, LatencyHistogram()) for stage in stages)
+        self._lock = threading.Lock()
+        self.report_requested = False
+
+    def record_frame(self, t_receive, t_decode, t_compute, t_writes):
+        """
+        Record one frame from its perf_counter_ns timestamps; t_writes holds the time
+        each channel write (or enqueue, with async_write) returned, in channel order
+        """
+        with self._lock:
+            histograms = self.histograms
+            histograms['decode'].record(t_decode - t_receive)
+            histograms['compute'].record(t_compute - t_decode)
+            t_prev = t_compute
+            for stage, t_write in zip(self.frame_stages, t_writes):
+                histograms[stage].record(t_write - t_prev)
+                t_prev = t_write
+            histograms['total'].record(t_prev - t_receive)
+        if self.report_requested:
+            self.report_requested = False
+            self.report()
+
+    def record_write(self, name, duration):
+        """
+        Record the duration (ns) of one phidget write of channel name, timed on its
+        writer thread (async_write only)
+        """
+        with self._lock:
+            self.histograms['write_' + name].record(duration)
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+
+    def report(self, file=None):
+        """
+        Print count, p50, p99, max and mean (in us) for every stage
+        """
+        file = sys.stdout if file is None else file
+        with self._lock:
+            print('{0:<16}{1:>10}{2:>12}{3:>12}{4:>12}{5:>12}'.format('latency (us)', 'count', 'p50', 'p99', 'max', 'mean'), file=file)
+            for stage, histogram in self.histograms.items():
+                print('{0:<16}{1:>10}{2:>12.1f}{3:>12.1f}{4:>12.1f}{5:>12.1f}'.format(
+                    stage, histogram.count, histogram.percentile(50) / 1e3, histogram.percentile(99) / 1e3,
+                    histogram.max / 1e3, histogram.mean() / 1e3), file=file)
+
+    def install_signal(self, signum=None):
+        """
+        Print the report, after the next frame, whenever signum (default SIGUSR1, where
+        available) is received
+        """
+        signum = getattr(signal, 'SIGUSR1', None) if signum is None else signum
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, self.request_report)
+        return True
+
+    def request_report(self, signum=None, frame=None):
+        """
+        Signal handler: have record_frame() print the report once the frame is recorded
+        """
+        self.report_requested = True
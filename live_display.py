@@ -0,0 +1,147 @@
+from __future__ import print_function
+import os
+import time
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+
+
+Position = namedtuple('Position', ['posx', 'posy', 'heading'])
+
+
+class PositionRing(object):
+    """
+    Single-writer ring buffer of (posx, posy, heading) in shared memory.
+
+    The writer (the control loop) stores each position in the next slot and then
+    publishes the new write count in the header; there is no lock, so push() never
+    waits on the reader. read() returns the positions written since the previous
+    read(), up to the last capacity of them if the reader fell behind. Created with no
+    name, the ring allocates the block; given the name of an existing ring, it attaches
+    to it.
+    """
+
+    header_size = 16 # int64 write count, int64 closed flag
+
+    def __init__(self, capacity=65536, name=None):
+        self.capacity = int(capacity)
+        self.owner = name is None
+        size = PositionRing.header_size + self.capacity * 3 * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+        self.header = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((self.capacity, 3), dtype=np.float64, buffer=self.shm.buf,
+                               offset=PositionRing.header_size)
+        if self.owner:
+            self.header[:] = 0
+        self.count = int(self.header[0])
+        self.read_count = 0
+
+    def push(self, posx, posy, heading):
+        count = self.count
+        self.data[count % self.capacity] = (posx, posy, heading)
+        self.count = count + 1
+        self.header[0] = count + 1
+
+    def read(self):
+        """
+        (n, 3) array of the positions written since the last read
+        """
+        count = int(self.header[0])
+        start = max(self.read_count, count - self.capacity)
+        rows = self.data[np.arange(start, count) % self.capacity]
+        # drop the rows the writer may have overwritten while they were copied
+        overwritten = int(self.header[0]) - self.capacity - start
+        if overwritten > 0:
+            rows = rows[overwritten:]
+        self.read_count = count
+        return rows
+
+    @property
+    def closed(self):
+        return bool(self.header[1])
+
+    def stop(self):
+        """
+        Tell the reader no more positions are coming
+        """
+        self.header[1] = 1
+
+    def close(self):
+        """
+        Release the shared memory (stopping the reader first when called by the writer)
+        """
+        if self.owner:
+            self.stop()
+        self.header = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class LiveDisplay(object):
+    """
+    Live display_2d.Display of the fly's path, running in its own process.
+
+    The control loop only calls push() (a shared-memory write); the display process
+    reads the new positions and redraws at most rate times a second, so matplotlib
+    never runs in, or blocks, the control loop.
+    """
+
+    def __init__(self, param=None, rate=30.0, capacity=65536):
+        self.ring = PositionRing(capacity)
+        self.push = self.ring.push
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=run_display, name='live-display',
+                                       args=(self.ring.name, capacity, rate, param))
+        self.process.daemon = True
+        self.process.start()
+
+    def close(self, timeout=2.0):
+        self.ring.stop()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
+
+
+def run_display(name, capacity, rate=30.0, param=None):
+    """
+    Display process: draw the positions published on the ring name at up to rate Hz
+    until the writer closes it
+    """
+    # on a machine short of cores, only draw when the control loop does not need the CPU
+    if hasattr(os, 'SCHED_IDLE'):
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    elif hasattr(os, 'nice'):
+        os.nice(10)
+    try:
+        from .display_2d import Display
+    except ImportError:
+        from display_2d import Display
+    display = Display(dict(Display.default_param, **(param or {})))
+    ring = PositionRing(capacity, name)
+    period = 1.0 / rate
+    t_next = time.perf_counter()
+    try:
+        while not ring.closed:
+            rows = ring.read()
+            if len(rows):
+                # the path is redrawn for the new axis range by update()
+                display.path_lod.extend(rows[:, 0], rows[:, 1])
+                position = Position(*rows[-1])
+                display.draw_fly(position)
+                display.fig.canvas.draw_idle()
+                display.update(position)
+            else:
+                display.fig.canvas.flush_events()
+            t_next += period
+            wait = t_next - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                t_next = time.perf_counter()
+    finally:
+        ring.close()
@@ -0,0 +1,179 @@
+from __future__ import print_function
+import json
+import math
+import time
+import threading
+from collections import deque
+import numpy as np
+
+
+class SyntheticSource(object):
+    """
+    In-process synthetic FicTrac publisher.
+
+    A background thread publishes random-walk FicTrac v2 data messages at rate Hz
+    (stopping after n_frames if given). It has the same listen()/drain()/unsubscribe()
+    interface as the redis subscribers in redis_reader, so it can replace the redis
+    transport of an AoutRunner. publish_ns holds the perf_counter_ns publish time of
+    every frame.
+    """
+
+    def __init__(self, rate=500.0, n_frames=None, seed=0):
+        self.rate = float(rate)
+        self.n_frames = n_frames
+        self.rng = np.random.default_rng(seed)
+        self.publish_ns = []
+        self.subscribed = True
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._publish, name='synthetic-fictrac')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _messages(self, batch=1000):
+        """
+        Random-walk messages, generated in batches to keep the publisher thread cheap
+        """
+        frame = 0
+        heading = intx = inty = posx = posy = 0.0
+        while True:
+            deltaheading = self.rng.normal(0, 2.0, batch)
+            velx = self.rng.normal(0.01, 0.01, batch)
+            vely = self.rng.normal(0, 0.005, batch)
+            for i in range(batch):
+                heading = (heading + deltaheading[i]) % 360.0
+                intx += velx[i]
+                inty += vely[i]
+                rad = math.radians(heading)
+                posx += velx[i] * math.cos(rad) - vely[i] * math.sin(rad)
+                posy += velx[i] * math.sin(rad) + vely[i] * math.cos(rad)
+                yield json.dumps({'deltaheading': deltaheading[i], 'frame': frame, 'heading': heading,
+                                  'intx': intx, 'inty': inty, 'posx': posx, 'posy': posy, 'type': 'data',
+                                  'velx': velx[i], 'vely': vely[i]}).encode()
+                frame += 1
+
+    def _publish(self):
+        period_ns = int(1e9 / self.rate)
+        clock = time.perf_counter_ns
+        t_next = clock()
+        for frame, message in enumerate(self._messages()):
+            if not self.subscribed or (self.n_frames is not None and frame >= self.n_frames):
+                break
+            # sleep rather than spin, so the publisher does not hold the GIL against the loop under test
+            wait = t_next - clock()
+            if wait > 0:
+                time.sleep(wait / 1e9)
+            with self._cond:
+                self.publish_ns.append(clock())
+                self._queue.append(message)
+                self._cond.notify()
+            t_next += period_ns
+        with self._cond:
+            self.subscribed = False
+            self._cond.notify()
+
+    def listen(self):
+        queue = self._queue
+        cond = self._cond
+        while True:
+            with cond:
+                while not queue and self.subscribed:
+                    cond.wait()
+                if not queue:
+                    return
+                message = queue.popleft()
+            yield message
+
+    def drain(self, block=True):
+        queue = self._queue
+        cond = self._cond
+        with cond:
+            while block and not queue and self.subscribed:
+                cond.wait()
+            payloads = list(queue)
+            queue.clear()
+        return payloads
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribed = False
+            self._cond.notify()
+
+    def close(self):
+        self.unsubscribe()
+        self._thread.join()
+
+
+class FakeVoltageOutput(object):
+    """
+    Stand-in for Phidget22 VoltageOutput that records every setVoltage call with its
+    perf_counter_ns time. write_delay (s) emulates a slow USB round-trip.
+    """
+
+    def __init__(self, write_delay=0.0):
+        self.write_delay = write_delay
+        self.channel = None
+        self.times = []
+        self.voltages = []
+
+    def setChannel(self, channel):
+        self.channel = channel
+
+    def getChannel(self):
+        return self.channel
+
+    def openWaitForAttachment(self, timeout):
+        pass
+
+    def setVoltage(self, voltage):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        self.times.append(time.perf_counter_ns())
+        self.voltages.append(voltage)
+
+    def close(self):
+        pass
+
+
+def load_test(runner_class=None, rate=500.0, duration=10.0, param=None, **run_kwargs):
+    """
+    Run an output class against the synthetic source and fake sink for duration
+    seconds, and report throughput, write interval jitter and publish-to-write latency
+    """
+    try:
+        from .aout_runner import AoutRunner
+    except ImportError:
+        from aout_runner import AoutRunner
+    runner_class = AoutRunner if runner_class is None else runner_class
+    param = dict(runner_class.DefaultParam if param is None else param)
+    param.update({'transport': 'synthetic', 'synthetic_rate': rate, 'synthetic_frames': int(rate * duration),
+                  'aout_sink': 'fake'})
+
+    runner = runner_class(param)
+    runner.print = False
+    runner.run(**run_kwargs) # returns once the source has published all its frames
+    runner.pubsub.close()
+
+    source = runner.pubsub
+    aout = runner.aout_y.aout if hasattr(runner.aout_y, 'aout') else runner.aout_y
+    write_ns = np.array(aout.times[1:], dtype=np.int64) # the first write is the 0 V set on open
+    publish_ns = np.array(source.publish_ns, dtype=np.int64)
+    report_load_test(rate, publish_ns, write_ns)
+    return runner
+
+
+def report_load_test(rate, publish_ns, write_ns):
+    n_published = len(publish_ns)
+    n_written = len(write_ns)
+    span = (publish_ns[-1] - publish_ns[0]) / 1e9 if n_published > 1 else 0.0
+    print('frames published:  {0} ({1:1.1f} Hz, target {2:g} Hz)'.format(n_published, (n_published - 1) / span if span else 0.0, rate))
+    print('frames written:    {0}'.format(n_written))
+    if n_written > 1:
+        interval = np.diff(write_ns) / 1e3
+        print('write interval:    mean {0:1.1f} us  std {1:1.1f} us  p99 {2:1.1f} us  max {3:1.1f} us'.format(
+            interval.mean(), interval.std(), np.percentile(interval, 99), interval.max()))
+    if n_written == n_published and n_written:
+        latency = (write_ns - publish_ns) / 1e3
+        print('publish to write:  p50 {0:1.1f} us  p99 {1:1.1f} us  max {2:1.1f} us'.format(
+            np.percentile(latency, 50), np.percentile(latency, 99), latency.max()))
@@ -0,0 +1,339 @@
+from __future__ import print_function
+import math
+import time
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+try:
+    from .volt_map import ChannelMap
+except ImportError:
+    from volt_map import ChannelMap
+
+
+class FirstOrderLowpass(object):
+    """
+    First order lowpass filter with cutoff (Hz), exact for irregular frame intervals:
+    the smoothing factor is computed from each sample's dt (s)
+    """
+
+    def __init__(self, cutoff=1.0, value_init=0.0):
+        self.cutoff = cutoff
+        self.value_init = value_init
+        self.omega = 2.0 * math.pi * cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = self.value_init
+
+    def update(self, value, dt):
+        tmp = self.omega * dt
+        self.value += tmp / (tmp + 1.0) * (value - self.value)
+        return self.value
+
+
+class Biquad(object):
+    """
+    Second order IIR section (direct form II transposed) with coefficients b, a
+    (a[0] == 1). Assumes samples at a fixed rate, so dt is ignored.
+    """
+
+    def __init__(self, b, a, value_init=0.0):
+        self.b0, self.b1, self.b2 = [float(x) for x in b]
+        _, self.a1, self.a2 = [float(x) for x in a]
+        self.value_init = value_init
+        self.reset()
+
+    @classmethod
+    def lowpass(cls, cutoff, fs, q=1.0 / math.sqrt(2.0)):
+        """
+        Lowpass at cutoff (Hz) for samples at fs (Hz); the default q gives the second
+        order Butterworth response, same as scipy.signal.butter(2, cutoff, fs=fs)
+        """
+        w0 = 2.0 * math.pi * cutoff / fs
+        alpha = math.sin(w0) / (2.0 * q)
+        cos_w0 = math.cos(w0)
+        a0 = 1.0 + alpha
+        b = ((1.0 - cos_w0) / 2.0 / a0, (1.0 - cos_w0) / a0, (1.0 - cos_w0) / 2.0 / a0)
+        return cls(b, (1.0, -2.0 * cos_w0 / a0, (1.0 - alpha) / a0))
+
+    def reset(self):
+        # steady state for a constant input of value_init
+        x = self.value_init
+        self.value = x
+        self.z1 = x - self.b0 * x
+        self.z2 = self.b2 * x - self.a2 * x
+
+    def update(self, value, dt=None):
+        y = self.b0 * value + self.z1
+        self.z1 = self.b1 * value - self.a1 * y + self.z2
+        self.z2 = self.b2 * value - self.a2 * y
+        self.value = y
+        return y
+
+
+class SosFilter(object):
+    """
+    Streaming IIR filter made of second-order sections.
+
+    The coefficients (an (n, 6) sos array, as from scipy.signal.butter(..., output='sos'))
+    are fixed at construction and the section states (zi) are carried between calls,
+    so a signal can be fed one sample at a time with update() or in micro-batches
+    with process(). Either way the output is bit-identical to scipy.signal.sosfilt
+    over the whole signal with the same initial state: update() runs the same
+    multiply-adds in the same order as sosfilt's inner loop. reset() starts the
+    filter in the steady state for a constant input value_init.
+    """
+
+    def __init__(self, sos, value_init=0.0):
+        self.sos = np.array(sos, dtype=np.float64)
+        if self.sos.ndim != 2 or self.sos.shape[1] != 6:
+            raise ValueError('sos must be an (n_sections, 6) array')
+        self.sections = [tuple(section) for section in self.sos.tolist()]
+        self.value_init = value_init
+        self.reset()
+
+    @classmethod
+    def butter_lowpass(cls, cutoff, fs, order=5, value_init=0.0):
+        return cls(butter_lowpass_sos(cutoff, fs, order), value_init)
+
+    def reset(self, value_init=None):
+        if value_init is not None:
+            self.value_init = value_init
+        self.value = self.value_init
+        self.state = (sosfilt_zi(self.sos) * self.value_init).tolist()
+
+    @property
+    def zi(self):
+        """
+        (n_sections, 2) array of the current section states
+        """
+        return np.array(self.state)
+
+    def update(self, value, dt=None):
+        """
+        Filter one sample (dt is ignored: the filter assumes a fixed sample rate)
+        """
+        x = value
+        for (b0, b1, b2, _, a1, a2), z in zip(self.sections, self.state):
+            y = b0 * x + z[0]
+            z[0] = b1 * x - a1 * y + z[1]
+            z[1] = b2 * x - a2 * y
+            x = y
+        self.value = x
+        return x
+
+    def process(self, values):
+        """
+        Filter a micro-batch (array) of samples, continuing from the current state
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return values.copy()
+        out, zf = sosfilt(self.sos, values, zi=self.zi)
+        self.state = zf.tolist()
+        self.value = float(out[-1])
+        return out
+
+
+def make_filter(kind, cutoff, fs, order=2):
+    """
+    Filter for one motion signal: 'first_order', 'biquad', 'butter' (order order, as
+    second-order sections) or None for no filtering
+    """
+    if kind is None:
+        return None
+    if kind == 'first_order':
+        return FirstOrderLowpass(cutoff)
+    if kind == 'biquad':
+        return Biquad.lowpass(cutoff, fs)
+    if kind == 'butter':
+        return SosFilter.butter_lowpass(cutoff, fs, order)
+    raise ValueError('unknown rate filter {0}'.format(kind))
+
+
+class MotionFilter(object):
+    """
+    Streaming heading rate, forward and side velocity of the fly, filtered.
+
+    Each frame is differenced against the previous one: heading rate (deg/s) from
+    the heading, taking the short way round, and forward/side velocity (rad/s of
+    ball rotation) from intx/inty. Differencing the cumulative values keeps the
+    rates right across dropped frames. Every signal has its own filter, so the state
+    is a handful of floats whatever the session length. update() returns the
+    vel_output signal divided by rate_to_volt_const (units per volt), clamped to
+    the aout_min_volt_vel..aout_max_volt_vel range.
+
+    The first order filter divides each difference by the time since the previous
+    frame and smooths over that time. The fixed-rate filters ('biquad', 'butter'),
+    and no filter, instead take one sample per FicTrac frame: the difference times
+    rate_filter_fs over the number of frames it spans (from the frame counter), so
+    frames delivered in bursts when the loop falls behind do not turn into rate
+    spikes. With latest_frame_only, frames
+    that are dropped are not filtered at all: the rates stay right but the filter
+    sees fewer samples than rate_filter_fs a second, which stretches its time
+    constant.
+    """
+
+    outputs = ('heading', 'forward', 'side')
+
+    def __init__(self, param):
+        if param['vel_output'] not in MotionFilter.outputs:
+            raise ValueError('unknown velocity output {0}'.format(param['vel_output']))
+        self.output = MotionFilter.outputs.index(param['vel_output'])
+        kind, cutoff, fs = param['rate_filter'], param['lowpass_cutoff'], param['rate_filter_fs']
+        order = param['rate_filter_order']
+        self.heading_filter = make_filter(kind, cutoff, fs, order)
+        self.forward_filter = make_filter(kind, cutoff, fs, order)
+        self.side_filter = make_filter(kind, cutoff, fs, order)
+        self.fixed_rate = kind != 'first_order'
+        self.fs = float(fs)
+        self.volt_map = ChannelMap(param['aout_min_volt_vel'], param['aout_max_volt_vel'], 1.0 / param['rate_to_volt_const'])
+        self.volt_of = self.volt_map.scalar
+        self.reset()
+
+    def reset(self):
+        self.time_prev = None
+        self.heading_rate = 0.0
+        self.forward_vel = 0.0
+        self.side_vel = 0.0
+        self.volt = self.volt_of(0.0)
+        for lowpass in (self.heading_filter, self.forward_filter, self.side_filter):
+            if lowpass is not None:
+                lowpass.reset()
+
+    def update(self, data, time_ns):
+        """
+        Add one frame at experiment time time_ns (integer ns) and return the velocity voltage
+        """
+        time_prev = self.time_prev
+        if time_prev is None:
+            self.save_prev_state(data, time_ns)
+            return self.volt
+        if self.fixed_rate:
+            frames = data.frame - self.frame_prev
+            dt = None
+            rate_scale = self.fs / frames if frames > 0 else self.fs # no usable frame counter: one frame
+        else:
+            if time_ns <= time_prev:
+                # no time has passed (e.g. a repeated timestamp): fold this frame into the next
+                return self.volt
+            dt = (time_ns - time_prev) * 1e-9
+            rate_scale = 1.0 / dt
+
+        dheading = (data.heading - self.heading_prev) % 360.0
+        if dheading > 180.0:
+            dheading -= 360.0
+        heading_rate = dheading * rate_scale
+        forward_vel = (data.intx - self.intx_prev) * rate_scale
+        side_vel = (data.inty - self.inty_prev) * rate_scale
+        self.save_prev_state(data, time_ns)
+
+        if self.heading_filter is not None:
+            heading_rate = self.heading_filter.update(heading_rate, dt)
+            forward_vel = self.forward_filter.update(forward_vel, dt)
+            side_vel = self.side_filter.update(side_vel, dt)
+        self.heading_rate = heading_rate
+        self.forward_vel = forward_vel
+        self.side_vel = side_vel
+
+        value = (heading_rate, forward_vel, side_vel)[self.output]
+        self.volt = self.volt_of(value)
+        return self.volt
+
+    def save_prev_state(self, data, time_ns):
+        self.time_prev = time_ns
+        self.frame_prev = data.frame
+        self.heading_prev = data.heading
+        self.intx_prev = data.intx
+        self.inty_prev = data.inty
+
+
+# Utilities
+# ---------------------------------------------------------------------------------------
+def butter_lowpass_sos(cutoff, fs, order=5):
+    """
+    Butterworth lowpass at cutoff (Hz) for samples at fs (Hz), as second-order sections
+    """
+    return butter(order, cutoff, btype='low', analog=False, output='sos', fs=fs)
+
+
+def butter_lowpass_filter(data, cutoff, fs, order=5):
+    """
+    Offline Butterworth lowpass of a whole array, from a zero initial state
+    """
+    return sosfilt(butter_lowpass_sos(cutoff, fs, order), data)
+
+
+def benchmark(n=100000, cutoff=0.5, fs=500.0, order=5, batch=50):
+    """
+    Time the streaming SosFilter, per sample and in micro-batches, against redesigning
+    the filter and refiltering the signal so far on every frame, and check it matches
+    sosfilt over the whole signal
+    """
+    x = np.random.default_rng(0).normal(size=n)
+    expected = butter_lowpass_filter(x, cutoff, fs, order)
+
+    lowpass = SosFilter.butter_lowpass(cutoff, fs, order)
+    update = lowpass.update
+    samples = x.tolist()
+    t0 = time.perf_counter()
+    per_sample = [update(value) for value in samples]
+    t_sample = (time.perf_counter() - t0) / n
+
+    lowpass.reset()
+    t0 = time.perf_counter()
+    batched = np.concatenate([lowpass.process(x[i:i + batch]) for i in range(0, n, batch)])
+    t_batch = (time.perf_counter() - t0) / n
+
+    # the batch filter as it would be used live: redesign and refilter a 1 s window per frame
+    m = 1000
+    window = int(fs)
+    t0 = time.perf_counter()
+    for i in range(window, window + m):
+        butter_lowpass_filter(x[i - window:i], cutoff, fs, order)[-1]
+    t_redesign = (time.perf_counter() - t0) / m
+
+    print('order {0} Butterworth lowpass, {1:g} Hz at {2:g} Hz'.format(order, cutoff, fs))
+    print('{0:<32}{1:>10.2f} us/sample'.format('streaming, per sample', t_sample * 1e6))
+    print('{0:<32}{1:>10.2f} us/sample'.format('streaming, {0} sample batches'.format(batch), t_batch * 1e6))
+    print('{0:<32}{1:>10.2f} us/sample'.format('redesign + refilter 1 s window', t_redesign * 1e6))
+    print('identical to sosfilt: per sample {0}, batched {1}'.format(
+        np.array_equal(per_sample, expected), np.array_equal(batched, expected)))
+    check_sos_filter(cutoff, fs, order)
+    print('check_sos_filter: passed')
+
+
+def check_sos_filter(cutoff=0.5, fs=500.0, order=5, n=20000, value_init=1.5, seed=0):
+    """
+    Equivalence test: a SosFilter fed one sample at a time, in micro-batches of varying
+    size, and in a mix of both, from a steady-state initial value, must give exactly
+    the output of sosfilt over the whole signal. Raises AssertionError otherwise.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.normal(value_init, 1.0, n)
+    sos = butter_lowpass_sos(cutoff, fs, order)
+    expected, _ = sosfilt(sos, x, zi=sosfilt_zi(sos) * value_init)
+
+    lowpass = SosFilter(sos, value_init)
+    per_sample = np.array([lowpass.update(value) for value in x.tolist()])
+
+    lowpass.reset()
+    bounds = np.unique(np.concatenate(([0, n], rng.integers(0, n, n // 20))))
+    batched = np.concatenate([lowpass.process(x[i:j]) for i, j in zip(bounds[:-1], bounds[1:])])
+
+    lowpass.reset()
+    mixed = []
+    for k, (i, j) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if k % 2:
+            mixed.extend(lowpass.update(value) for value in x[i:j].tolist())
+        else:
+            mixed.extend(lowpass.process(x[i:j]).tolist())
+
+    for name, out in (('per sample', per_sample), ('batched', batched), ('mixed', np.array(mixed))):
+        if not np.array_equal(out, expected):
+            raise AssertionError('SosFilter {0} output differs from sosfilt at {1} of {2} samples'.format(
+                name, np.count_nonzero(out != expected), n))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,107 @@
+from __future__ import print_function
+import threading
+import queue
+import numpy as np
+
+
+class NoiseBuffer(object):
+    """
+    Ring of pre-generated gaussian noise for the per-frame feedback transforms.
+
+    Noise (mean 0, sd sigma) is drawn from a numpy Generator seeded with seed in
+    batches of batch_size and converted to a plain list, so next() is a scalar list
+    read. A background thread keeps the following batch ready, so refills happen off
+    the frame loop. Values beyond +-clip are clamped to +-clip (mode 'clip', as the
+    original noise feedback) or redrawn (mode 'truncate'); clip None leaves them.
+    With no seed a fresh one is drawn; it is kept in seed so a session can be
+    reproduced, and the same seed gives the same sequence whether it is read by next()
+    or take().
+    """
+
+    Modes = ('clip', 'truncate')
+
+    def __init__(self, sigma=1.0, clip=0.3, seed=None, batch_size=65536, mode='clip'):
+        if mode not in NoiseBuffer.Modes:
+            raise ValueError('unknown noise mode {0!r}, expected one of {1}'.format(mode, ', '.join(NoiseBuffer.Modes)))
+        if mode == 'truncate' and not clip:
+            raise ValueError("noise mode 'truncate' needs a clip value")
+        self.sigma = float(sigma)
+        self.clip = clip
+        self.mode = mode
+        self.batch_size = int(batch_size)
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.rng = np.random.default_rng(self.seed)
+        self.batches = 0
+
+        self._buffer = self._generate()
+        self._pos = 0
+        self._ready = queue.Queue(maxsize=1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._refill, name='noise-buffer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _generate(self):
+        noise = self.rng.normal(0.0, self.sigma, self.batch_size)
+        if self.clip is not None and self.mode == 'clip':
+            np.clip(noise, -self.clip, self.clip, out=noise)
+        elif self.clip is not None:
+            outside = np.flatnonzero(np.abs(noise) > self.clip)
+            while len(outside):
+                noise[outside] = self.rng.normal(0.0, self.sigma, len(outside))
+                outside = outside[np.abs(noise[outside]) > self.clip]
+        self.batches += 1
+        return noise.tolist()
+
+    def _refill(self):
+        while not self._closed:
+            batch = self._generate()
+            while not self._closed:
+                try:
+                    self._ready.put(batch, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+
+    def _swap(self):
+        self._buffer = self._ready.get()
+        self._pos = 0
+
+    def next(self):
+        """
+        Next noise value
+        """
+        try:
+            value = self._buffer[self._pos]
+        except IndexError:
+            self._swap()
+            value = self._buffer[0]
+        self._pos += 1
+        return value
+
+    def take(self, n):
+        """
+        Next n noise values as an array, continuing the same sequence as next()
+        """
+        out = np.empty(n)
+        filled = 0
+        while filled < n:
+            if self._pos >= len(self._buffer):
+                self._swap()
+            k = min(n - filled, len(self._buffer) - self._pos)
+            out[filled:filled + k] = self._buffer[self._pos:self._pos + k]
+            self._pos += k
+            filled += k
+        return out
+
+    def close(self):
+        """
+        Stop the refill thread (the buffer cannot be read past its current batch afterwards)
+        """
+        self._closed = True
+        # free the slot so a refill waiting to put its batch returns at once
+        try:
+            self._ready.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
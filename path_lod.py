@@ -0,0 +1,237 @@
+from __future__ import print_function
+import numpy as np
+
+
+class PathPyramid(object):
+    """
+    Multi-resolution (level of detail) copy of a 2D trajectory, for drawing long paths
+    with only as many vertices as the view needs.
+
+    Level k (k >= 1) splits the path into buckets of factor**k points and keeps, from
+    each, the points with the smallest and largest x and y (min/max decimation, at most
+    4 points per bucket, in path order), so the outline of the path is kept at every
+    level. Points can be added at any time (extend()/append()); each bucket is reduced
+    once, when it is complete, and the incomplete end of a level is filled in from the
+    finer levels. view() picks the finest level that puts at most max_vertices points
+    in the axis range.
+
+    Every bucket also keeps its bounding box. view() culls with them from the coarsest
+    level down, testing only the children of the buckets that meet the axis range, so
+    a redraw scans the visible part of the path rather than all of it.
+    """
+
+    def __init__(self, posx=(), posy=(), factor=8):
+        self.factor = factor
+        self.n = 0
+        self._x = np.empty(1024)
+        self._y = np.empty(1024)
+        self.levels = [] # per level: list of index arrays of the reduced buckets
+        self.bounds = [] # per level: list of (buckets, 4) arrays of xmin, xmax, ymin, ymax
+        self.covered = [] # per level: number of points in its complete buckets
+        self._cache = [] # per level: concatenated indices and bounds
+        self._sequences = {} # per level: the parts of the drawn point sequence, until the next extend()
+        self.extend(posx, posy)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def posx(self):
+        return self._x[:self.n]
+
+    @property
+    def posy(self):
+        return self._y[:self.n]
+
+    def append(self, x, y):
+        self.extend((x,), (y,))
+
+    def extend(self, posx, posy):
+        posx = np.asarray(posx, dtype=np.float64)
+        posy = np.asarray(posy, dtype=np.float64)
+        n = self.n + len(posx)
+        if n > len(self._x):
+            size = max(n, 2 * len(self._x))
+            self._x = np.resize(self._x, size)
+            self._y = np.resize(self._y, size)
+        self._x[self.n:n] = posx
+        self._y[self.n:n] = posy
+        self.n = n
+        self._sequences = {}
+        self._update_levels()
+
+    def _update_levels(self):
+        k = 0
+        size = self.factor
+        while size <= self.n:
+            if k == len(self.levels):
+                self.levels.append([])
+                self.bounds.append([])
+                self.covered.append(0)
+                self._cache.append(None)
+            start = self.covered[k]
+            stop = start + (self.n - start) // size * size
+            if stop > start:
+                self.levels[k].append(bucket_extremes(self._x, self._y, start, stop, size))
+                self.bounds[k].append(bucket_bounds(self._x, self._y, start, stop, size))
+                self.covered[k] = stop
+                self._cache[k] = None
+            k += 1
+            size *= self.factor
+
+    def _level(self, k):
+        if self._cache[k] is None:
+            if len(self.levels[k]) > 1:
+                self.levels[k] = [np.concatenate(self.levels[k])]
+                self.bounds[k] = [np.concatenate(self.bounds[k])]
+            self._cache[k] = self.levels[k][0], self.bounds[k][0]
+        return self._cache[k]
+
+    def _sequence(self, level):
+        """
+        The points drawn at level (0: every point) in path order, as parts: index
+        arrays of the reduced buckets of level and then of the finer levels over its
+        incomplete end, and the first of the remaining points, which are all drawn.
+        Returns the parts, that first point and the offsets of the parts in the sequence.
+        """
+        sequence = self._sequences.get(level)
+        if sequence is None:
+            parts = []
+            covered = 0
+            for k in range(level - 1, -1, -1):
+                index = self._level(k)[0]
+                parts.append(index[np.searchsorted(index, covered):])
+                covered = self.covered[k]
+            offsets = np.cumsum([0] + [len(part) for part in parts] + [self.n - covered])
+            sequence = self._sequences[level] = parts, covered, offsets
+        return sequence
+
+    def _visible_buckets(self, k, parents, xlim, ylim):
+        """
+        Buckets of level k + 1 whose bounding box meets the axis range: the children of
+        the visible buckets parents of the next coarser level (None: test every bucket)
+        and the buckets past the end of that level
+        """
+        bounds = self._level(k)[1]
+        if parents is None:
+            candidates = np.arange(len(bounds))
+        else:
+            children = (parents[:, None] * self.factor + np.arange(self.factor)).ravel()
+            first = self.covered[k + 1] // self.factor ** (k + 1)
+            candidates = np.concatenate((children, np.arange(first, len(bounds))))
+        box = bounds[candidates]
+        hit = ((box[:, 0] <= max(xlim)) & (box[:, 1] >= min(xlim)) &
+               (box[:, 2] <= max(ylim)) & (box[:, 3] >= min(ylim)))
+        return candidates[hit]
+
+    def _ranges(self, k, buckets):
+        """
+        Merged [start, stop) point ranges of the buckets of level k + 1, plus the
+        points past the end of that level
+        """
+        size = self.factor ** (k + 1)
+        starts = buckets * size
+        stops = starts + size
+        if self.covered[k] < self.n:
+            starts = np.append(starts, self.covered[k])
+            stops = np.append(stops, self.n)
+        if not len(starts):
+            return starts, stops
+        apart = starts[1:] != stops[:-1]
+        return starts[np.append(True, apart)], stops[np.append(apart, True)]
+
+    def _window(self, level, starts, stops, xlim, ylim):
+        """
+        (x, y, inside) of the points of level in the ranges, each range with the points
+        just before and after it in the level, and NaN between the ranges
+        """
+        parts, covered, offsets = self._sequence(level)
+
+        def rank(index):
+            # number of points of the level before each point index
+            before = np.clip(index - covered, 0, self.n - covered)
+            for part in parts:
+                before += np.searchsorted(part, index)
+            return before
+
+        lo = np.maximum(rank(starts) - 1, 0)
+        hi = np.minimum(rank(stops) + 1, offsets[-1])
+        lengths = hi - lo
+        first = np.cumsum(lengths) - lengths
+        position = np.arange(lengths.sum()) + np.repeat(lo - first, lengths)
+        part_of = np.searchsorted(offsets, position, side='right') - 1
+        index = position - offsets[-2] + covered
+        for k, part in enumerate(parts):
+            in_part = part_of == k
+            index[in_part] = part[position[in_part] - offsets[k]]
+        x = self._x[index]
+        y = self._y[index]
+        breaks = first[1:]
+        return (np.insert(x, breaks, np.nan), np.insert(y, breaks, np.nan),
+                np.insert(in_range(x, y, xlim, ylim), breaks, False))
+
+    def view(self, xlim, ylim, max_vertices=4000):
+        """
+        (x, y) of the path within the axis range at the finest level that has at most
+        max_vertices points there, with NaN breaks where the path leaves the range
+        """
+        best = None
+        buckets = None
+        starts = np.zeros(1, dtype=np.int64)
+        stops = np.array([self.n], dtype=np.int64)
+        for level in range(len(self.levels), -1, -1):
+            if level > 0:
+                # level 0 draws the points of the finest visible buckets
+                buckets = self._visible_buckets(level - 1, buckets, xlim, ylim)
+                starts, stops = self._ranges(level - 1, buckets)
+            x, y, inside = self._window(level, starts, stops, xlim, ylim)
+            if best is not None and np.count_nonzero(inside) > max_vertices:
+                break
+            best = x, y, inside
+        return window_path(*best)
+
+
+# Utilities
+# ---------------------------------------------------------------------------------------
+def bucket_extremes(posx, posy, start, stop, size):
+    """
+    Sorted, unique indices of the min/max x and y points of each size-point bucket in start:stop
+    """
+    x = posx[start:stop].reshape(-1, size)
+    y = posy[start:stop].reshape(-1, size)
+    index = np.stack((x.argmin(axis=1), x.argmax(axis=1), y.argmin(axis=1), y.argmax(axis=1)), axis=1)
+    index.sort(axis=1)
+    index += (start + size * np.arange(len(index)))[:, None]
+    keep = np.ones(index.shape, dtype=bool)
+    keep[:, 1:] = index[:, 1:] != index[:, :-1]
+    return index[keep]
+
+
+def bucket_bounds(posx, posy, start, stop, size):
+    """
+    (buckets, 4) array of the x and y range (xmin, xmax, ymin, ymax) of each size-point bucket in start:stop
+    """
+    x = posx[start:stop].reshape(-1, size)
+    y = posy[start:stop].reshape(-1, size)
+    return np.stack((x.min(axis=1), x.max(axis=1), y.min(axis=1), y.max(axis=1)), axis=1)
+
+
+def in_range(posx, posy, xlim, ylim):
+    return ((posx >= min(xlim)) & (posx <= max(xlim)) &
+            (posy >= min(ylim)) & (posy <= max(ylim)))
+
+
+def window_path(posx, posy, inside):
+    """
+    The points of a path where inside is True, plus their neighbours so segments
+    crossing the edge of the window are drawn, with NaN breaks at the gaps so the
+    line does not join across them
+    """
+    keep = inside.copy()
+    keep[1:] |= inside[:-1]
+    keep[:-1] |= inside[1:]
+    index = np.flatnonzero(keep)
+    if len(index) == 0:
+        return np.empty(0), np.empty(0)
+    breaks = np.flatnonzero(np.diff(index) > 1) + 1
+    return np.insert(posx[index], breaks, np.nan), np.insert(posy[index], breaks, np.nan)
@@ -11,16 +11,19 @@ import ffmpeg
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.cm as cm
 from matplotlib.collections import LineCollection
 from matplotlib.colors import ListedColormap, BoundaryNorm, Normalize
 import cmocean
 from itertools import compress
+from concurrent.futures import ProcessPoolExecutor
 
 from pathlib import Path
 
 from .display_2d import Display
+from .path_lod import PathPyramid, in_range, window_path
 
 
 class Figure2D(object):
@@ -31,66 +34,71 @@ class Figure2D(object):
     def __init__(self, file, param=DefaultParam):
         self.param = param
         self.file = file
-        f = h5py.File(file, 'r')
-        self.times = list(f['time'])
-        self.posx = list(f['posx'])
-        self.posy = list(f['posy'])
-        self.headings = list(f['heading'])
+        # keep the h5py datasets and read only the slices each plot needs, so loading
+        # costs nothing whatever the session length. close() (or a with block) closes the file
+        self.h5 = h5py.File(file, 'r')
+        f = self.h5
+        self.times = f['time']
+        self.posx = f['posx']
+        self.posy = f['posy']
+        self.headings = f['heading']
         params = json.loads(f.attrs['jsonparam'])
-        self.stim_x = list(f['stim_x'])
-        self.stim_y = list(f['stim_y'])
-        self.pulse_on = list(f['pulse_on'])
-        self.stim_heading = list(f['stim_heading'])
-
-        if not self.param['experiment_type'] == 'freewalk':
-            self.pulse_on = list(f['pulse_on'])
+        self.stim_x = f['stim_x']
+        self.stim_y = f['stim_y']
+        self.pulse_on = f['pulse_on']
+        self.stim_heading = f['stim_heading']
 
         self.param = params
 
         self.display = Display(params)
 
-    def plot_2d(self):
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
 
-        #plot path
-        if self.param['experiment_type'] == 'freewalk':
-            self.display.pos_line.set_xdata(self.posx)
-            self.display.pos_line.set_ydata(self.posy)
-        else:
-            self.display.pos_line.set_visible(True)
-            # Create a set of line segments so that we can color them individually
-            # This creates the points as a N x 1 x 2 array so that we can stack points
-            # together easily to get the segments. The segments array for line collection
-            # needs to be (numlines) x (points per line) x 2 (for x and y)
-            points = np.array([self.posx, self.posy]).T.reshape(-1, 1, 2)
-            segments = np.concatenate([points[:-1], points[1:]], axis=1)
-            axs = self.display.ax
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *exc_info):
+        self.close()
 
+    def plot_2d(self):
+        posx = self.posx[:]
+        posy = self.posy[:]
 
-            self.display.pos_line.set_xdata(self.posx)
-            self.display.pos_line.set_ydata(self.posy)
+        #plot path (drawn from a level of detail pyramid once the axis range is set)
+        self.display.path_lod = PathPyramid(posx, posy)
+        if not self.param['experiment_type'] == 'freewalk':
+            self.display.pos_line.set_visible(True)
 
-            on_points = np.squeeze(points[np.array(self.pulse_on, dtype=bool)])
-            plt.plot(on_points[:, 0], on_points[:, 1], 'r.')
-            # Use a boundary norm instead
+            pulse_on = self.pulse_on[:].astype(bool)
+            plt.plot(posx[pulse_on], posy[pulse_on], 'r.')
+            # Use a boundary norm instead, with the path as a set of individually coloured
+            # (numlines) x (points per line) x 2 segments
+            #points = np.column_stack((posx, posy)).reshape(-1, 1, 2)
+            #segments = np.concatenate([points[:-1], points[1:]], axis=1)
             #colormap_two = ListedColormap(['k', 'r'])
             #norm = BoundaryNorm([-0.5, 0.5, 1.5], colormap_two.N)
             #lc = LineCollection(segments, cmap=colormap_two, norm=norm)
-            #lc.set_array(np.array(self.pulse_on[:-1]))
+            #lc.set_array(pulse_on[:-1])
             #lc.set_linewidth(2)
-            #line = axs.add_collection(lc)
+            #line = self.display.ax.add_collection(lc)
 
 
-        positions = np.transpose([self.posx, self.posy])
-        self.display.pos_arrow.set_offsets(positions[::300])
-        u_list = [math.cos(math.radians(head)) for head in self.headings[::300]]
-        v_list = [math.sin(math.radians(head)) for head in self.headings[::300]]
-        colors = np.arctan2(v_list, u_list)
+        # heading arrows every 300 samples
+        headings = np.radians(self.headings[::300])
+        u = np.cos(headings)
+        v = np.sin(headings)
+        colors = np.arctan2(v, u)
         norm = Normalize()
         norm.autoscale(colors)
         colormap = cmocean.cm.phase
 
-        self.display.pos_arrow.set_UVC(u_list, v_list) #, colors/2*np.pi + 1
+        # a quiver has a fixed number of arrows, so replace the single live-display arrow
+        arrow = self.display.pos_arrow
+        self.display.pos_arrow = self.display.ax.quiver(posx[::300], posy[::300], u, v, cmap=arrow.get_cmap()) #, colors/2*np.pi + 1
+        arrow.remove()
         #self.display.pos_arrow.set_cmap(colormap)
 
         # hide arrow
@@ -99,9 +107,9 @@ class Figure2D(object):
 
         # plot start and end (maybe introduce text)
 
-        start_text = plt.text(self.posx[0], self.posy[0], 'START', horizontalalignment='center',
+        start_text = plt.text(posx[0], posy[0], 'START', horizontalalignment='center',
                               verticalalignment='center', color='g')
-        end_text = plt.text(self.posx[-1], self.posy[-1], 'END', horizontalalignment='center',
+        end_text = plt.text(posx[-1], posy[-1], 'END', horizontalalignment='center',
                               verticalalignment='center', color='b')
 
 
@@ -109,10 +117,16 @@ class Figure2D(object):
         if self.param['experiment_type'] == 'freewalk':
             self.display.set_stim_enabled(False)
         else:
-            self.display.set_stim_enabled(True)
-            self.stim_x_display = np.unique([num for num in self.stim_x if num != 0])[0]
-            self.stim_y_display = np.unique([num for num in self.stim_y if num != 0])[0]
-            self.stim_heading_display = np.unique([num for num in self.stim_heading if num != 0])[0]
+            try:
+                self.stim_x_display = min_nonzero(self.stim_x)
+                self.stim_y_display = min_nonzero(self.stim_y)
+                self.stim_heading_display = min_nonzero(self.stim_heading)
+            except ValueError:
+                # no stimulus recorded (SessionRecorder writes stim_x/stim_y as zeros)
+                self.display.set_stim_enabled(False)
+            else:
+                self.display.set_stim_enabled(True)
+                self.display.draw_stim(self.stim_x_display, self.stim_y_display, self.stim_heading_display)
 
         self.display.set_stim_type(self.param['experiment_type'])
         self.display.stim_on = False
@@ -123,17 +137,20 @@ class Figure2D(object):
         # adjust range
         #plt.axis('normal')
         self.display.ax.set_aspect('equal', 'box')
-        rangex = max(self.posx) - min(self.posx)
-        rangey = max(self.posy) - min(self.posy)
+        min_x, max_x = min_max(posx)
+        min_y, max_y = min_max(posy)
+        rangex = max_x - min_x
+        rangey = max_y - min_y
         extra = 50
         if rangex > rangey:
-            self.display.ax.set_xlim(min(self.posx) - extra, max(self.posx) + extra)
-            y_avg = (min(self.posy) + max(self.posy)) / 2
+            self.display.ax.set_xlim(min_x - extra, max_x + extra)
+            y_avg = (min_y + max_y) / 2
             self.display.ax.set_ylim(y_avg - rangex * 0.5 - extra, y_avg + rangex * 0.5 + extra)
         else:
-            self.display.ax.set_ylim(min(self.posy) - extra, max(self.posy) + extra)
-            x_avg = (min(self.posx) + max(self.posx)) / 2
+            self.display.ax.set_ylim(min_y - extra, max_y + extra)
+            x_avg = (min_x + max_x) / 2
             self.display.ax.set_xlim(x_avg - rangey * 0.5 - extra, x_avg + rangey * 0.5 + extra)
+        self.display.draw_path_lod()
 
         self.display.fig.tight_layout()
         filename = os.path.splitext(self.file)
@@ -143,42 +160,188 @@ class Figure2D(object):
         plt.close()
 
 
-    def movie_2d(self):
-
-        intrange = np.arange(0, len(self.posx), 1)
-
-        Writer = animation.writers['ffmpeg']
-        writer = Writer(fps=150, metadata=dict(artist='Me'), bitrate=1800)
-
-        ani = animation.FuncAnimation(
-            self.display.fig, self.animate, init_func=None, frames=intrange, fargs=(self.posx, self.posy))
-
-        filename = os.path.splitext(self.file)
-        ani.save(filename[0] + '.mp4', fps=150)
-
-    def init(self):
-        return self.display
-
-    def animate(self, i, posx, posy):
-        # plot path
-        self.display.pos_line.set_xdata(posx[0:i + 1])
-        self.display.pos_line.set_ydata(posy[0:i + 1])
-        self.display.pos_dot.set_xdata(posx[i])
-        self.display.pos_dot.set_ydata(posy[i])
-        self.xlim = posx[i] - 10, posx[i] + 10
-        self.ylim = posy[i] - 10, posy[i] + 10
-        self.display.ax.set_xlim(*self.xlim)
-        self.display.ax.set_ylim(*self.ylim)
-        # plot stim
-        if self.param['experiment_type'] == 'freewalk':
-            self.display.set_stim_enabled(False)
-            self.display.text.set_text('')
+    def movie_2d(self, fps=150, processes=1, chunks=None, half_width=10.0, recenter=0.5):
+        """
+        Render the session to <file>.mp4, one video frame per sample, with the view
+        following the fly (see MovieRenderer). With processes > 1 the session is split
+        into chunks (default: one per process) rendered in a process pool and then
+        concatenated by ffmpeg.
+        """
+        filename = os.path.splitext(self.file)[0] + '.mp4'
+        n = len(self.posx)
+        chunks = processes if chunks is None else chunks
+        if processes <= 1 and chunks <= 1:
+            render_movie(self.file, self.param, filename, 0, n, fps, half_width, recenter)
+            return filename
+
+        bounds = np.linspace(0, n, chunks + 1).astype(int)
+        parts = ['{0}.part{1:03d}.mp4'.format(filename, k) for k in range(chunks)]
+        with ProcessPoolExecutor(processes) as pool:
+            jobs = [pool.submit(render_movie, self.file, self.param, part, start, stop, fps, half_width, recenter)
+                    for part, start, stop in zip(parts, bounds[:-1], bounds[1:])]
+            for job in jobs:
+                job.result()
+        concat_movies(parts, filename)
+        for part in parts:
+            os.remove(part)
+        return filename
+
+
+class MovieRenderer(object):
+    """
+    Renders frames of a session movie into an offscreen Agg canvas.
+
+    The view is a (2 half_width) wide window that is only moved when the fly gets more
+    than recenter * half_width from its centre (recenter 0: every frame). Moving the
+    view redraws the axes with just the part of the path inside the window; between
+    moves each frame restores the cached background, draws the one new path segment,
+    caches the result and draws the fly on top, so a frame costs the same at the end
+    of a session as at the start.
+    """
+
+    def __init__(self, posx, posy, pulse_on, param, half_width=10.0, recenter=0.5, size=(6.4, 4.8), dpi=100):
+        self.posx = posx
+        self.posy = posy
+        self.pulse_on = pulse_on
+        self.half_width = half_width
+        self.recenter = recenter * half_width
+        self.stim = param.get('experiment_type', 'freewalk') != 'freewalk'
+        fly_color = param.get('fly_color', 'k')
+
+        self.fig = Figure(figsize=size, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_aspect('equal', 'box')
+        self.ax.grid(True)
+        self.ax.set_xlabel('x pos')
+        self.ax.set_ylabel('y pos')
+        self.ax.set_title('FicTrac 2D')
+        self.path, = self.ax.plot([], [], fly_color)
+        self.segment, = self.ax.plot([], [], fly_color, animated=True)
+        self.dot, = self.ax.plot([], [], 'o', color=fly_color, animated=True)
+        self.fly_color = fly_color
+        self.canvas.draw()
+        self.width, self.height = self.canvas.get_width_height()
+
+        self.centre = None
+        self.background = None
+
+    def set_view(self, x, y, stop):
+        """
+        Centre the view on (x, y) and redraw the axes with the path before sample stop
+        """
+        w = self.half_width
+        self.centre = x, y
+        self.ax.set_xlim(x - w, x + w)
+        self.ax.set_ylim(y - w, y + w)
+        posx = self.posx[:stop]
+        posy = self.posy[:stop]
+        self.path.set_data(*window_path(posx, posy, in_range(posx, posy, (x - 2 * w, x + 2 * w), (y - 2 * w, y + 2 * w))))
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+
+    def render(self, i):
+        """
+        Draw frame i (frames must be rendered in order after the first) and return the RGBA buffer
+        """
+        x = self.posx[i]
+        y = self.posy[i]
+        if self.centre is None or abs(x - self.centre[0]) > self.recenter or abs(y - self.centre[1]) > self.recenter:
+            self.set_view(x, y, i + 1)
         else:
-            self.display.set_stim_enabled(True)
-            self.display.set_stim_on(self.pulse_on[i])
-
-        self.display.set_stim_type(self.param['experiment_type'])
-        self.display.set_stim_center(self.stim_x, self.stim_y)
-        self.display.draw_stim()
+            self.canvas.restore_region(self.background)
+            self.segment.set_data(self.posx[i - 1:i + 1], self.posy[i - 1:i + 1])
+            self.ax.draw_artist(self.segment)
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.dot.set_data([x], [y])
+        self.dot.set_color('r' if self.stim and self.pulse_on[i] else self.fly_color)
+        self.ax.draw_artist(self.dot)
+        return self.canvas.buffer_rgba()
+
+    def first_view(self, start):
+        """
+        Camera position at frame start, replaying the view moves from the beginning so a
+        chunk rendered on its own matches the same frames rendered in one go
+        """
+        posx = self.posx
+        posy = self.posy
+        recenter = self.recenter
+        cx, cy = posx[0], posy[0]
+        for i in range(start):
+            if abs(posx[i] - cx) > recenter or abs(posy[i] - cy) > recenter:
+                cx, cy = posx[i], posy[i]
+        return cx, cy
+
+
+def render_movie(file, param, out_file, start, stop, fps=150, half_width=10.0, recenter=0.5):
+    """
+    Render frames start to stop of a session file into out_file, piping raw RGBA
+    frames to ffmpeg (runs in the worker processes of Figure2D.movie_2d)
+    """
+    with h5py.File(file, 'r') as f:
+        posx = f['posx'][:stop]
+        posy = f['posy'][:stop]
+        pulse_on = f['pulse_on'][:stop]
+    renderer = MovieRenderer(posx, posy, pulse_on, param, half_width, recenter)
+    if start > 0:
+        # start on the view the fly had at this frame in a single-pass render
+        cx, cy = renderer.first_view(start)
+        renderer.set_view(cx, cy, start)
+
+    process = (ffmpeg
+               .input('pipe:', format='rawvideo', pix_fmt='rgba', s='{0}x{1}'.format(renderer.width, renderer.height),
+                      framerate=fps)
+               .output(out_file, pix_fmt='yuv420p', vcodec='libx264')
+               .overwrite_output()
+               .run_async(pipe_stdin=True, quiet=True))
+    try:
+        for i in range(start, stop):
+            process.stdin.write(renderer.render(i))
+    finally:
+        process.stdin.close()
+        process.wait()
+
+
+def concat_movies(parts, out_file):
+    """
+    Join movie chunks without re-encoding (ffmpeg concat demuxer)
+    """
+    list_file = out_file + '.parts.txt'
+    with open(list_file, 'w') as f:
+        for part in parts:
+            f.write("file '{0}'\n".format(os.path.abspath(part)))
+    try:
+        ffmpeg.input(list_file, format='concat', safe=0).output(out_file, c='copy').overwrite_output().run(quiet=True)
+    finally:
+        os.remove(list_file)
+
+
+# Utilities
+# ---------------------------------------------------------------------------------------
+def min_max(values, chunk_size=1 << 16):
+    """
+    (min, max) of an array in one pass over memory: both are taken over each
+    cache-sized chunk before moving on to the next
+    """
+    lo = hi = values[0]
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        lo = min(lo, chunk.min())
+        hi = max(hi, chunk.max())
+    return lo, hi
+
+
+def min_nonzero(dataset, chunk_size=1 << 20):
+    """
+    Smallest non-zero value of a dataset, read chunk_size samples at a time
+    """
+    result = None
+    for start in range(0, len(dataset), chunk_size):
+        chunk = dataset[start:start + chunk_size]
+        chunk = chunk[chunk != 0]
+        if len(chunk):
+            result = chunk.min() if result is None else min(result, chunk.min())
+    if result is None:
+        raise ValueError('{0} has no non-zero values'.format(dataset.name))
+    return result
 
-        return self.display
\ No newline at end of file
@@ -0,0 +1,127 @@
+from __future__ import print_function
+import json
+import numpy as np
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    from .aout_engine import FeedbackTransform, GainTransform, JumpTransform, NoiseTransform, OpenLoopTransform
+    from .experiment_clock import BlockTimer
+except ImportError:
+    from aout_engine import FeedbackTransform, GainTransform, JumpTransform, NoiseTransform, OpenLoopTransform
+    from experiment_clock import BlockTimer
+
+
+# Block transforms: name -> (transform class, {block key: constructor argument})
+BlockTransforms = {
+    'gain': (GainTransform, {'gain': 'gain'}),
+    'noise': (NoiseTransform, {'gain': 'gain', 'clip': 'noise_clip', 'sigma': 'noise_sigma', 'seed': 'seed', 'mode': 'noise_mode'}),
+    'jump': (JumpTransform, {'gain': 'gain', 'jump': 'jump'}),
+    'open_loop': (OpenLoopTransform, {'heading': 'heading', 'rate': 'rate'}),
+}
+
+
+class Protocol(FeedbackTransform):
+    """
+    Multi-block experiment protocol.
+
+    blocks is a list of dicts, each with a duration (s), a transform name (see
+    BlockTransforms, default 'gain') and that transform's settings, e.g.
+
+        {'duration': 60, 'transform': 'noise', 'gain': 0.5, 'sigma': 1.0, 'clip': 0.3}
+
+    The block transforms are built once and looked up by block index, with the block
+    boundaries precomputed by a BlockTimer, so each frame costs a single index step
+    whatever the number of blocks. After the last block the last transform is held.
+    blocks holds the block dicts with the seed of every noise block filled in.
+    """
+
+    def __init__(self, blocks):
+        if not blocks:
+            raise ValueError('protocol has no blocks')
+        self.blocks = [dict(block) for block in blocks]
+        self.transforms = [make_transform(block) for block in self.blocks]
+        for block, transform in zip(self.blocks, self.transforms):
+            if isinstance(transform, NoiseTransform):
+                block['seed'] = transform.noise.seed # the drawn seed when none was given, so the block can be reproduced
+        self.durations = [float(block['duration']) for block in self.blocks]
+        self.duration = sum(self.durations)
+        self.timer = BlockTimer(np.cumsum(self.durations))
+        self.table = self.transforms + [self.transforms[-1]] # index len(blocks) is past the end of the protocol
+
+    def setup(self, engine):
+        FeedbackTransform.setup(self, engine)
+        for transform in self.transforms:
+            transform.setup(engine)
+
+    def reset(self):
+        self.timer.reset()
+        for transform in self.transforms:
+            transform.reset()
+
+    def close(self):
+        for transform in self.transforms:
+            transform.close()
+
+    @property
+    def block(self):
+        return min(self.timer.index, len(self.blocks) - 1)
+
+    def __call__(self, accum_heading, time_ns):
+        return self.table[self.timer.block(time_ns)](accum_heading, time_ns)
+
+    def apply_array(self, accum_heading, time_ns):
+        time_ns = np.asarray(time_ns)
+        index = np.minimum(self.timer.blocks(time_ns), len(self.blocks) - 1)
+        heading = np.empty(len(accum_heading))
+        volt = np.empty(len(accum_heading))
+        for i, transform in enumerate(self.transforms):
+            in_block = index == i
+            if in_block.any():
+                heading[in_block], volt[in_block] = transform.apply_array(accum_heading[in_block], time_ns[in_block])
+        return heading, volt
+
+
+def make_transform(block):
+    """
+    Build the feedback transform of one protocol block
+    """
+    if 'duration' not in block:
+        raise ValueError('protocol block {0!r} has no duration'.format(block))
+    name = block.get('transform', 'gain')
+    try:
+        transform_class, arguments = BlockTransforms[name]
+    except KeyError:
+        raise ValueError('unknown block transform {0!r}, expected one of {1}'.format(name, ', '.join(sorted(BlockTransforms))))
+    unknown = set(block) - set(arguments) - {'duration', 'transform', 'name'}
+    if unknown:
+        raise ValueError('unknown setting(s) {0} for {1!r} block'.format(', '.join(sorted(unknown)), name))
+    return transform_class(**dict((arguments[key], value) for key, value in block.items() if key in arguments))
+
+
+def load_protocol(file):
+    """
+    Load a protocol from a JSON or YAML (.yaml/.yml, needs PyYAML) file holding either
+    a list of blocks or a mapping with a 'blocks' list
+    """
+    spec = load_config(file)
+    if isinstance(spec, dict):
+        spec = spec.get('blocks')
+    if not isinstance(spec, list):
+        raise ValueError('{0} does not hold a list of protocol blocks'.format(file))
+    return Protocol(spec)
+
+
+def load_config(file):
+    """
+    Contents of a JSON or YAML (.yaml/.yml, needs PyYAML) file
+    """
+    with open(file) as f:
+        if file.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError('PyYAML is needed to load {0}'.format(file))
+            return yaml.safe_load(f)
+        return json.load(f)
@@ -0,0 +1,251 @@
+from __future__ import print_function
+import socket
+import redis
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+class RawSubscriber(object):
+    """
+    Low-level redis subscriber for one pub/sub channel.
+
+    Talks RESP directly over a socket instead of going through redis-py's PubSub, and
+    yields only the message payload bytes. Replies are parsed with hiredis when it is
+    installed, otherwise with the pure Python RespReader. drain() returns every message
+    already queued on the socket in one go, so the caller can skip straight to the
+    newest frame.
+    """
+
+    def __init__(self, channel='fictrac', host='localhost', port=6379, bufsize=65536, timeout=None):
+        self.channel = channel.encode() if isinstance(channel, str) else channel
+        self.bufsize = bufsize
+        self.timeout = timeout
+        self.reader = hiredis.Reader() if hiredis is not None else RespReader()
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.subscribed = False
+        self.subscribe()
+
+    def send_command(self, *args):
+        self.sock.sendall(encode_command(*args))
+
+    def subscribe(self):
+        """
+        Subscribe to the channel and wait for the confirmation
+        """
+        self.send_command(b'SUBSCRIBE', self.channel)
+        while True:
+            reply = self.read_reply()
+            if isinstance(reply, Exception):
+                raise reply
+            if reply[0] == b'subscribe':
+                self.subscribed = True
+                return
+
+    def unsubscribe(self):
+        """
+        Stop listening; listen() ends after the message being handled
+        """
+        if self.subscribed:
+            self.subscribed = False
+            try:
+                self.send_command(b'UNSUBSCRIBE', self.channel)
+            except OSError:
+                pass
+
+    def close(self):
+        self.unsubscribe()
+        self.sock.close()
+
+    def fill(self):
+        """
+        Block until more data arrives on the socket and feed it to the parser
+        """
+        data = self.sock.recv(self.bufsize)
+        if not data:
+            raise ConnectionError('redis connection closed')
+        self.reader.feed(data)
+
+    def read_reply(self):
+        reply = self.reader.gets()
+        while reply is False:
+            self.fill()
+            reply = self.reader.gets()
+        return reply
+
+    def listen(self):
+        """
+        Yield the payload of each message published on the channel
+        """
+        gets = self.reader.gets
+        channel = self.channel
+        while self.subscribed:
+            reply = gets()
+            if reply is False:
+                self.fill()
+                continue
+            if type(reply) is list and reply[0] == b'message' and reply[1] == channel:
+                yield reply[2]
+
+    def drain(self, block=True):
+        """
+        Return the payloads of all messages already received, reading everything
+        available on the socket without waiting. If block is True and nothing is
+        queued, wait for at least one message.
+        """
+        payloads = []
+        self._parse_into(payloads)
+        if not payloads and block:
+            while not payloads and self.subscribed:
+                self.fill()
+                self._parse_into(payloads)
+        self.sock.setblocking(False)
+        try:
+            while True:
+                try:
+                    data = self.sock.recv(self.bufsize)
+                except (BlockingIOError, InterruptedError):
+                    break
+                if not data:
+                    raise ConnectionError('redis connection closed')
+                self.reader.feed(data)
+                self._parse_into(payloads)
+        finally:
+            self.sock.settimeout(self.timeout)
+        return payloads
+
+    def _parse_into(self, payloads):
+        gets = self.reader.gets
+        channel = self.channel
+        reply = gets()
+        while reply is not False:
+            if type(reply) is list and reply[0] == b'message' and reply[1] == channel:
+                payloads.append(reply[2])
+            reply = gets()
+
+
+class PubSubReader(object):
+    """
+    redis-py PubSub subscriber with the same listen()/drain()/unsubscribe() interface
+    as RawSubscriber, yielding only the message payloads
+    """
+
+    def __init__(self, channel='fictrac', client=None):
+        self.client = redis.StrictRedis() if client is None else client
+        self.pubsub = self.client.pubsub()
+        self.pubsub.subscribe(channel)
+        self.subscribed = True
+
+    def unsubscribe(self):
+        if self.subscribed:
+            self.subscribed = False
+            self.pubsub.unsubscribe()
+
+    def close(self):
+        self.unsubscribe()
+        self.pubsub.close()
+
+    def listen(self):
+        for item in self.pubsub.listen():
+            if not self.subscribed:
+                return
+            if item['type'] == 'message':
+                yield item['data']
+
+    def drain(self, block=True):
+        """
+        Return the payloads of all messages already received, without waiting unless
+        block is True and nothing is queued
+        """
+        pubsub = self.pubsub
+        payloads = []
+        item = pubsub.get_message(timeout=None if block else 0.0)
+        while item is not None:
+            if item['type'] == 'message':
+                payloads.append(item['data'])
+            item = pubsub.get_message(timeout=0.0)
+        return payloads
+
+
+# RESP protocol
+# ---------------------------------------------------------------------------------------
+class RespError(Exception):
+    """
+    Error reply from the redis server
+    """
+    pass
+
+
+class _Incomplete(Exception):
+    pass
+
+
+class RespReader(object):
+    """
+    Pure Python RESP parser with the same feed()/gets() interface as hiredis.Reader.
+    gets() returns False while the buffered data does not hold a complete reply.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+
+    def feed(self, data):
+        if self.pos:
+            del self.buf[:self.pos]
+            self.pos = 0
+        self.buf += data
+
+    def gets(self):
+        try:
+            reply, self.pos = self._parse(self.pos)
+        except _Incomplete:
+            return False
+        return reply
+
+    def _parse(self, pos):
+        buf = self.buf
+        end = buf.find(b'\r\n', pos)
+        if end < 0:
+            raise _Incomplete()
+        prefix = buf[pos]
+        line = bytes(buf[pos + 1:end])
+        pos = end + 2
+        if prefix == 36: # '$' bulk string
+            n = int(line)
+            if n < 0:
+                return None, pos
+            if len(buf) < pos + n + 2:
+                raise _Incomplete()
+            return bytes(buf[pos:pos + n]), pos + n + 2
+        if prefix == 42: # '*' array
+            n = int(line)
+            if n < 0:
+                return None, pos
+            items = []
+            for _ in range(n):
+                item, pos = self._parse(pos)
+                items.append(item)
+            return items, pos
+        if prefix == 58: # ':' integer
+            return int(line), pos
+        if prefix == 43: # '+' simple string
+            return line, pos
+        if prefix == 45: # '-' error
+            return RespError(line.decode('utf-8', 'replace')), pos
+        raise ValueError('invalid RESP prefix {0!r}'.format(chr(prefix)))
+
+
+def encode_command(*args):
+    """
+    Encode a redis command as a RESP array of bulk strings
+    """
+    parts = [b'*', str(len(args)).encode(), b'\r\n']
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts += [b'$', str(len(arg)).encode(), b'\r\n', arg, b'\r\n']
+    return b''.join(parts)
@@ -0,0 +1,140 @@
+from __future__ import print_function
+import time
+import numpy as np
+
+try:
+    from .aout_engine import AoutEngine, GainTransform
+    from .fictrac_decoder import frame_dtype, FicTracDecoder
+    from .experiment_clock import seconds_to_ns
+except ImportError:
+    from aout_engine import AoutEngine, GainTransform
+    from fictrac_decoder import frame_dtype, FicTracDecoder
+    from experiment_clock import seconds_to_ns
+
+
+def load_dat(file):
+    """
+    Load a FicTrac v2 .dat log into (records, time_elapsed).
+
+    Columns used (1-based, FicTrac v2 output): 1 frame counter, 15-16 integrated x/y
+    position (lab), 17 integrated heading (rad), 20-21 integrated forward/side motion,
+    22 timestamp (ms). heading is converted to degrees as in the redis messages;
+    deltaheading, velx and vely are the frame-to-frame differences of heading (wrapped
+    to +-180 deg), intx and inty.
+    """
+    log = np.loadtxt(file, delimiter=',', ndmin=2)
+    n = log.shape[0]
+    records = np.zeros(n, dtype=frame_dtype)
+    records['frame'] = log[:, 0]
+    records['posx'] = log[:, 14]
+    records['posy'] = log[:, 15]
+    records['heading'] = np.degrees(log[:, 16])
+    records['intx'] = log[:, 19]
+    records['inty'] = log[:, 20]
+    records['deltaheading'][1:] = np.mod(np.diff(records['heading']) + 180.0, 360.0) - 180.0
+    records['velx'][1:] = np.diff(records['intx'])
+    records['vely'][1:] = np.diff(records['inty'])
+    records['timestamp'] = log[:, 21]
+    return records, (log[:, 21] - log[0, 21]) / 1000.0
+
+
+def load_redis_dump(file, fps):
+    """
+    Load a capture of the redis 'fictrac' channel into (records, time_elapsed).
+
+    The file holds one message per line; lines that are not a json data message (e.g.
+    the 'message' / 'fictrac' lines of redis-cli subscribe output, or reset messages)
+    are skipped. time_elapsed comes from the message timestamps when present,
+    otherwise from the frame count / fps.
+    """
+    decode = FicTracDecoder().decode
+    frames = []
+    with open(file, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith(b'{'):
+                continue
+            try:
+                data = decode(line)
+            except ValueError:
+                continue
+            if data.type == 'data':
+                frames.append((data.frame, data.heading, data.deltaheading, data.intx, data.inty,
+                               data.posx, data.posy, data.velx, data.vely, data.timestamp))
+    records = np.array(frames, dtype=frame_dtype)
+    if len(records) and records['timestamp'][0]:
+        return records, (records['timestamp'] - records['timestamp'][0]) / 1000.0
+    return records, (records['frame'] - (records['frame'][0] if len(records) else 0)) / float(fps)
+
+
+def replay(records, time_elapsed, transform=None, param=AoutEngine.DefaultParam):
+    """
+    Run the closed-loop voltage transforms over a recorded session (time_elapsed in s)
+    without hardware. Returns the per-frame voltage traces as a structured array
+    (aout_engine.output_dtype).
+    """
+    engine = AoutEngine(param, GainTransform(1) if transform is None else transform)
+    return engine.update_array(records, seconds_to_ns(time_elapsed))
+
+
+def replay_frames(records, time_elapsed, transform=None, param=AoutEngine.DefaultParam):
+    """
+    Reference frame-by-frame replay through AoutEngine.update, as run live
+    """
+    engine = AoutEngine(param, GainTransform(1) if transform is None else transform)
+    out = np.empty((len(records), 4))
+    for i, (record, t) in enumerate(zip(records, seconds_to_ns(time_elapsed))):
+        out[i] = engine.update(RecordFrame(record), int(t))
+    return out
+
+
+class RecordFrame(object):
+    """
+    Attribute access to one structured array record, as the engine expects from a frame
+    """
+
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getattr__(self, name):
+        return float(self.record[name])
+
+
+def synthetic_session(n, fps=100.0, seed=0):
+    """
+    Random-walk session of n frames, for benchmarking and checking the replay
+    """
+    rng = np.random.default_rng(seed)
+    records = np.zeros(n, dtype=frame_dtype)
+    records['frame'] = np.arange(n)
+    records['deltaheading'] = rng.normal(0, 2.0, n)
+    records['heading'] = np.mod(np.cumsum(records['deltaheading']), 360.0)
+    records['velx'] = rng.normal(0.01, 0.01, n)
+    records['vely'] = rng.normal(0, 0.005, n)
+    records['intx'] = np.cumsum(records['velx'])
+    records['inty'] = np.cumsum(records['vely'])
+    heading = np.radians(records['heading'])
+    records['posx'] = np.cumsum(records['velx'] * np.cos(heading) - records['vely'] * np.sin(heading))
+    records['posy'] = np.cumsum(records['velx'] * np.sin(heading) + records['vely'] * np.cos(heading))
+    return records, np.arange(n) / fps
+
+
+def benchmark(n=360000, fps=100.0):
+    """
+    Time the vectorized replay against the frame-by-frame engine on an hour-long synthetic session
+    """
+    records, time_elapsed = synthetic_session(n, fps)
+    t0 = time.perf_counter()
+    traces = replay(records, time_elapsed)
+    t_vector = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    reference = replay_frames(records, time_elapsed)
+    t_frames = time.perf_counter() - t0
+    same = all(np.array_equal(traces[name], reference[:, i])
+               for i, name in enumerate(('volt_yaw', 'volt_x', 'volt_yaw_gain', 'volt_y')))
+    print('{0} frames ({1:1.0f} s at {2:g} Hz)'.format(n, n / fps, fps))
+    print('{0:<24}{1:>10.1f} ms'.format('vectorized replay', t_vector * 1e3))
+    print('{0:<24}{1:>10.1f} ms  ({2:1.0f}x)'.format('frame by frame', t_frames * 1e3, t_frames / t_vector))
+    print('identical: {0}'.format(same))
@@ -0,0 +1,29 @@
+from fictrac_decoder import benchmark as benchmark_decoder
+from replay import benchmark as benchmark_replay
+from virtual_hallway import benchmark as benchmark_hallway
+from arena import benchmark as benchmark_arena
+from motion_filter import benchmark as benchmark_filter
+from volt_map import benchmark as benchmark_volt_map
+
+print('FicTrac message decoding')
+benchmark_decoder()
+
+print()
+print('Offline replay')
+benchmark_replay()
+
+print()
+print('Virtual hallway')
+benchmark_hallway()
+
+print()
+print('Arena region lookup')
+benchmark_arena()
+
+print()
+print('Streaming rate filter')
+benchmark_filter()
+
+print()
+print('Voltage mapping')
+benchmark_volt_map()
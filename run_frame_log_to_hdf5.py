@@ -0,0 +1,5 @@
+import sys
+from frame_log import frame_log_to_hdf5
+
+for file in sys.argv[1:]:
+    print(frame_log_to_hdf5(file))
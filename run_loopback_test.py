@@ -0,0 +1,4 @@
+from loopback import load_test
+from analogout import FicTracAout
+
+load_test(FicTracAout, rate=500, duration=10)
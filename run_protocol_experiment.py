@@ -0,0 +1,5 @@
+import sys
+from aoutProtocolExperiment import ProtocolOutput
+
+client = ProtocolOutput()
+client.run(sys.argv[1] if len(sys.argv) > 1 else 'protocols/gain_blocks.json')
@@ -1,81 +1,16 @@
 #Code for virtual hallway with reward and punishment
 
-from tkinter import *
-#import easygui
+from aoutVirtualHallway import HallwayAout
 
-width = input('width = ')
-length = input('length = ')
-reward1 = input('reward1 = ')
-reward2 = input('reward2 = ')
+#Define the virtual hallway dimensions (mm) and the reward locations along it
+width = float(input('width = '))
+length = float(input('length = '))
+reward1 = float(input('reward1 = '))
+reward2 = float(input('reward2 = '))
 
-#def makeentry(parent, caption, width=None, **options):
- #   Label(parent, text=caption).pack(side=TOP)
-  #  entry = Entry(parent, **options)
-  #  if width:
-   #     entry.config(width=width)
-   # entry.pack(side=TOP)
-#    return entry
+param = dict(HallwayAout.DefaultParam, hallway_width=width, hallway_length=length, hallway_rewards=(reward1, reward2))
 
-
-#class StartGUI(object):
-
-#	def __init__(self,window):
-
-#		self.window = window #opens window
-#		self.widthBox = makeentry(self.window, 'width', 50 ) #box to get width value
-#		self.lengthBox = makeentry(self.window, 'length', 50 )
-#		self.reward1Box = makeentry(self.window, 'reward1', 50 )
-#		self.reward2Box = makeentry(self.window, 'reward2', 50 )
-#		self.btn = Button(self.window,text='OK',command=self.getValues) #draws button
-#		self.btn.pack(side=BOTTOM) #put the button at the bottom
-#		self.width = []
-#		self.length = []
-#		self.reward1 = []
-#		self.reward2 = []
-#		self.window.mainloop()
-
-
-#	def getValues(self):
-	
-#		self.width = self.widthBox.get()
-#		self.length = self.lengthBox.get()
-#		self.reward1 = self.reward1Box.get()
-#		self.reward2 = self.reward2Box.get()
-#		self.window.destroy()
-
-
-#StartGUI(Tk())
-
-width = input('width')
-
-#Define the virtual hallway dimensions
-
-#make GUI to get input for hallway dimensions
-#width = 
-#length =
-
-#and to get thepush reward locations
-#reward1 = 
-#reward2 =
-
-
-#Get the fly's data in time
-
-#while True
-
-#Reconstruct the animal's trajectory
-
-
-
-#Conditional statement to give aversive stim to animal if it touches the virtual walls
-
-#if posx =< or posx >= or posy =< or posy >= 
-
-
-
-#Give virtual reward if it reaches the reward locations
-
-#if posy == reward1  or posy == reward2
-
-
-#%Plot the animal's trajectory live in the virtual box
\ No newline at end of file
+#Reconstruct the animal's trajectory from the fictrac data, give the aversive stim when
+#it touches the virtual walls and the reward when it reaches the reward locations
+client = HallwayAout(param)
+client.run()
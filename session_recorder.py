@@ -0,0 +1,160 @@
+from __future__ import print_function
+import json
+import queue
+import threading
+import numpy as np
+import h5py
+
+
+# One recorded frame: FicTrac inputs and the commanded outputs
+record_dtype = np.dtype([
+    ('frame', np.int64),
+    ('time', np.float64), # experiment time (s)
+    ('timestamp', np.float64), # FicTrac timestamp (ms)
+    ('posx', np.float64),
+    ('posy', np.float64),
+    ('heading', np.float64),
+    ('intx', np.float64),
+    ('inty', np.float64),
+    ('deltaheading', np.float64),
+    ('velx', np.float64),
+    ('vely', np.float64),
+    ('volt_yaw', np.float64),
+    ('volt_x', np.float64),
+    ('volt_yaw_gain', np.float64),
+    ('volt_y', np.float64),
+    ('stim_heading', np.float64), # heading shown on the yaw_gain channel (deg)
+    ('block', np.int32), # block index of the feedback transform
+])
+
+# Datasets plot_pos.Figure2D reads that the closed-loop runners have no use for
+# (no 2D stimulus, no pulses); written as zeros
+constant_datasets = [('stim_x', np.float64), ('stim_y', np.float64), ('pulse_on', np.int8)]
+
+# Figure2D / display_2d.Display settings stored in jsonparam unless param sets them
+display_param = {
+    'experiment_type': 'freewalk',
+    'display_xlim': (-20, 20),
+    'display_ylim': (-20, 20),
+    'fly_color': 'k',
+}
+
+
+class SessionRecorder(object):
+    """
+    Records every frame's inputs and output voltages to an HDF5 file in the layout
+    plot_pos.Figure2D reads: one chunked, resizable dataset per field of
+    record_dtype (plus stim_x, stim_y, pulse_on) and the param dict as a json string
+    in the 'jsonparam' attribute.
+
+    record() only appends a tuple to a list; every batch_size frames the list is
+    handed to a background thread that converts it and appends it to the datasets,
+    so the control loop never waits on the disk. The file is flushed after every
+    batch.
+    """
+
+    def __init__(self, file, param=None, batch_size=1000):
+        self.file = file
+        self.batch_size = int(batch_size)
+        self.recorded = 0
+        self.error = None
+
+        self.h5 = create_session(file, param, self.batch_size)
+
+        self._rows = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='session-recorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, data, time_ns, volt_yaw, volt_x, volt_yaw_gain, volt_y, stim_heading, block):
+        """
+        Add one data frame (a FicTracFrame) at experiment time time_ns with its output voltages
+        """
+        rows = self._rows
+        rows.append((data.frame, time_ns / 1e9, data.timestamp, data.posx, data.posy, data.heading, data.intx,
+                     data.inty, data.deltaheading, data.velx, data.vely, volt_yaw, volt_x, volt_yaw_gain, volt_y,
+                     stim_heading, block))
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hand the frames recorded so far to the writer thread
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        if self._rows:
+            self._queue.put(self._rows)
+            self._rows = []
+
+    def _loop(self):
+        while True:
+            rows = self._queue.get()
+            if rows is None:
+                return
+            try:
+                self._write(np.array(rows, dtype=record_dtype))
+            except Exception as error:
+                self.error = error
+
+    def _write(self, batch):
+        self.recorded = append_records(self.h5, self.recorded, batch)
+        self.h5.flush()
+
+    def save_param(self, param):
+        """
+        Replace the jsonparam attribute, e.g. once the noise seeds are known
+        """
+        write_param(self.h5, param)
+
+    def close(self):
+        """
+        Write the remaining frames and close the file
+        """
+        if self._rows:
+            self._queue.put(self._rows)
+            self._rows = []
+        self._queue.put(None)
+        self._thread.join()
+        self.h5.close()
+        if self.error is not None:
+            raise self.error
+
+
+# Utilities
+# ---------------------------------------------------------------------------------------
+def create_session(file, param=None, chunk_size=1000):
+    """
+    New HDF5 session file with empty, resizable datasets and the jsonparam attribute
+    """
+    h5 = h5py.File(file, 'w')
+    write_param(h5, param)
+    for name, dtype in [(name, record_dtype[name]) for name in record_dtype.names] + constant_datasets:
+        h5.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(chunk_size,))
+    return h5
+
+
+def write_param(h5, param=None):
+    """
+    Store param (with the display_param defaults) as json in the jsonparam attribute
+    """
+    jsonparam = dict(display_param, **(param or {}))
+    h5.attrs['jsonparam'] = json.dumps(jsonparam, default=str)
+
+
+def append_records(h5, start, batch):
+    """
+    Write a record_dtype array to the session datasets from index start; returns the new length
+    """
+    stop = start + len(batch)
+    for name in record_dtype.names:
+        dataset = h5[name]
+        dataset.resize((stop,))
+        dataset[start:stop] = batch[name]
+    for name, dtype in constant_datasets:
+        h5[name].resize((stop,))
+        h5[name][start:stop] = np.zeros(len(batch), dtype=dtype)
+    return stop
+
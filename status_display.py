@@ -0,0 +1,77 @@
+from __future__ import print_function
+import sys
+import shutil
+import threading
+
+
+class StatusDisplay(object):
+    """
+    Rate-limited console status line.
+
+    The control loop only stores a reference to its latest values with update(); a
+    background thread formats and writes the newest snapshot rate times a second.
+    Rebinding an attribute is atomic, so the loop never takes a lock or waits on
+    console I/O, and frames between two refreshes are simply not shown.
+
+    On a terminal the line is redrawn in place, so it is cut (or padded) to the
+    terminal width: a line that wrapped would scroll instead of being overwritten.
+    """
+
+    def __init__(self, format_status, rate=10.0, stream=None):
+        self.format_status = format_status
+        self.period = 1.0 / rate
+        self.stream = sys.stdout if stream is None else stream
+        self.snapshot = None
+        self._shown = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self, snapshot):
+        """
+        Publish the latest values (called from the control loop)
+        """
+        self.snapshot = snapshot
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='status-display')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop refreshing, after showing the last snapshot
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.refresh()
+        if self._shown is not None and self._is_tty():
+            self.stream.write('\n')
+            self.stream.flush()
+
+    def refresh(self):
+        snapshot = self.snapshot
+        if snapshot is None or snapshot is self._shown:
+            return
+        self._shown = snapshot
+        line = self.format_status(snapshot)
+        if self._is_tty():
+            # one column short of the width, as some terminals wrap on writing the last one
+            width = shutil.get_terminal_size().columns - 1
+            self.stream.write(line[:width].ljust(width) + '\r')
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def _is_tty(self):
+        isatty = getattr(self.stream, 'isatty', None)
+        return isatty is not None and isatty()
+
+    def _loop(self):
+        while not self._stop.wait(self.period):
+            self.refresh()
@@ -0,0 +1,143 @@
+from __future__ import print_function
+import math
+import time
+import numpy as np
+
+try:
+    from .fictrac_decoder import FicTracFrame
+except ImportError:
+    from fictrac_decoder import FicTracFrame
+
+
+# Zone codes
+FREE = 0
+WALL = 1
+REWARD = 2
+
+
+class ZoneGrid(object):
+    """
+    Precomputed zone lookup table over a rectangle.
+
+    codes[iy, ix] is the zone of the cell_size square cell at (x0 + ix * cell_size,
+    y0 + iy * cell_size); positions outside the rectangle are in the outside zone. A
+    lookup is two multiplications and a list index, whatever the geometry.
+    """
+
+    def __init__(self, codes, origin=(0.0, 0.0), cell_size=1.0, outside=WALL):
+        self.codes = np.asarray(codes)
+        self.x0, self.y0 = origin
+        self.cell_size = float(cell_size)
+        self.inv_cell = 1.0 / self.cell_size
+        self.ny, self.nx = self.codes.shape
+        self.outside = outside
+        self._rows = self.codes.tolist() # plain lists index faster than an ndarray for single lookups
+
+    def zone(self, x, y):
+        ix = math.floor((x - self.x0) * self.inv_cell)
+        iy = math.floor((y - self.y0) * self.inv_cell)
+        if 0 <= ix < self.nx and 0 <= iy < self.ny:
+            return self._rows[iy][ix]
+        return self.outside
+
+    def zones(self, x, y):
+        """
+        Vectorized zone() over arrays of positions
+        """
+        ix = np.floor((np.asarray(x) - self.x0) * self.inv_cell).astype(np.int64)
+        iy = np.floor((np.asarray(y) - self.y0) * self.inv_cell).astype(np.int64)
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+        out = np.full(ix.shape, self.outside, dtype=self.codes.dtype)
+        out[inside] = self.codes[iy[inside], ix[inside]]
+        return out
+
+
+class Hallway(object):
+    """
+    Straight virtual corridor, width wide (x from 0 to width) and length long (y from
+    0 to length), closed by walls, with a reward band reward_size long across the
+    corridor at each y in rewards. Distances in mm. The geometry is rasterized once
+    into a ZoneGrid of cell_size cells.
+    """
+
+    def __init__(self, width=20.0, length=200.0, rewards=(), reward_size=5.0, cell_size=0.25):
+        self.width = float(width)
+        self.length = float(length)
+        self.rewards = [float(r) for r in rewards]
+        self.reward_size = float(reward_size)
+        nx = int(math.ceil(self.width / cell_size))
+        ny = int(math.ceil(self.length / cell_size))
+        codes = np.full((ny, nx), FREE, dtype=np.int8)
+        centre_y = (np.arange(ny) + 0.5) * cell_size
+        for reward in self.rewards:
+            codes[np.abs(centre_y - reward) <= self.reward_size / 2] = REWARD
+        self.grid = ZoneGrid(codes, (0.0, 0.0), cell_size, outside=WALL)
+
+    @property
+    def start(self):
+        return self.width / 2, 0.0
+
+
+class HallwayEngine(object):
+    """
+    Integrates the fly's position in a Hallway from FicTrac frames.
+
+    Each frame's ball rotation (velx forward, vely sideways, rad) times ball_radius
+    (mm) is turned by the fly's heading into a step in the corridor; heading_offset
+    (deg) is added to the FicTrac heading so the fly starts facing down the corridor
+    (+y). A step into a wall is not taken: the fly stays put and the frame's zone is
+    WALL.
+    """
+
+    def __init__(self, hallway, ball_radius=4.5, heading_offset=90.0):
+        self.hallway = hallway
+        self.zone_at = hallway.grid.zone
+        self.ball_radius = ball_radius
+        self.heading_offset = heading_offset
+        self.reset()
+
+    def reset(self):
+        self.x, self.y = self.hallway.start
+        self.zone = FREE
+
+    def update(self, data):
+        """
+        Move by one frame (a FicTracFrame or anything with heading, velx and vely)
+        and return the zone the fly is in
+        """
+        rad = math.radians(data.heading + self.heading_offset)
+        cos_h = math.cos(rad)
+        sin_h = math.sin(rad)
+        r = self.ball_radius
+        x = self.x + (data.velx * cos_h - data.vely * sin_h) * r
+        y = self.y + (data.velx * sin_h + data.vely * cos_h) * r
+        zone = self.zone_at(x, y)
+        if zone != WALL:
+            self.x = x
+            self.y = y
+        self.zone = zone
+        return zone
+
+
+def benchmark(n=500000, fps=500.0):
+    """
+    Time HallwayEngine.update per frame on a synthetic session, against the FicTrac frame period
+    """
+    try:
+        from .replay import synthetic_session
+    except ImportError:
+        from replay import synthetic_session
+    records, _ = synthetic_session(n)
+    frames = [FicTracFrame(heading=float(r['heading']), velx=float(r['velx']), vely=float(r['vely'])) for r in records]
+    hallway = Hallway(20.0, 200.0, rewards=(50.0, 150.0))
+    engine = HallwayEngine(hallway)
+    update = engine.update
+    counts = [0, 0, 0]
+    t0 = time.perf_counter()
+    for data in frames:
+        counts[update(data)] += 1
+    elapsed = time.perf_counter() - t0
+    per_frame = elapsed / n
+    print('{0} frames: {1:1.2f} us/frame ({2:1.0f} frames/s, {3:1.2f}% of a {4:g} Hz frame period)'.format(
+        n, per_frame * 1e6, 1.0 / per_frame, per_frame * fps * 100, fps))
+    print('frames in free / wall / reward zones: {0} / {1} / {2}'.format(*counts))
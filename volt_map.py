@@ -0,0 +1,97 @@
+from __future__ import print_function
+import time
+import numpy as np
+
+
+class ChannelMap(object):
+    """
+    Transfer function of one output channel, in four steps: wrap x to [0, period)
+    (if period is given), scale by scale, clip to volt_min..volt_max and, with invert,
+    mirror about the middle of the range.
+
+    scalar is a closure specialised for these settings, for the per-frame path;
+    array() is the vectorized equivalent and gives bit-identical voltages. Calling
+    the map picks one or the other from the type of x.
+    """
+
+    def __init__(self, volt_min, volt_max, scale=1.0, period=None, invert=False):
+        self.volt_min = float(volt_min)
+        self.volt_max = float(volt_max)
+        self.scale = scale
+        self.period = period
+        self.invert = invert
+        self.scalar = self._scalar_kernel()
+
+    def _scalar_kernel(self):
+        lo, hi, factor, period = self.volt_min, self.volt_max, self.scale, self.period
+        total = lo + hi
+        scaled = factor != 1.0
+        inverted = self.invert
+
+        def scalar(x):
+            if period is not None:
+                x = x % period
+            if scaled:
+                x = x * factor
+            x = lo if x < lo else (hi if x > hi else x)
+            return total - x if inverted else x
+        return scalar
+
+    def array(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.period is not None:
+            x = np.mod(x, self.period)
+        if self.scale != 1.0:
+            x = x * self.scale
+        x = np.clip(x, self.volt_min, self.volt_max)
+        if self.invert:
+            return (self.volt_min + self.volt_max) - x
+        return x
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            return self.array(x)
+        return self.scalar(x)
+
+
+def benchmark(n=200000, volt_min=0.0, volt_max=10.0):
+    """
+    Time the yaw and x channel maps against the inline wrap / scale / max(min()) clamp
+    sequence they replace, per frame and over whole arrays
+    """
+    rng = np.random.default_rng(0)
+    heading = rng.uniform(0, 360, n)
+    intx = rng.normal(0, 50, n)
+    heading_list = heading.tolist()
+    intx_list = intx.tolist()
+    two_pi = 2 * np.pi
+    volt_range = volt_max - volt_min
+    yaw_scale = volt_range / 360.0
+    int_scale = volt_range / two_pi
+
+    def clamp(x, min_val, max_val):
+        return max(min(x, max_val), min_val)
+
+    t0 = time.perf_counter()
+    inline = [((volt_max + volt_min) - clamp(h * yaw_scale, volt_min, volt_max),
+               clamp((x % two_pi) * int_scale, volt_min, volt_max)) for h, x in zip(heading_list, intx_list)]
+    t_inline = time.perf_counter() - t0
+
+    yaw = ChannelMap(volt_min, volt_max, yaw_scale, invert=True)
+    x_map = ChannelMap(volt_min, volt_max, int_scale, period=two_pi)
+    yaw_volt = yaw.scalar
+    x_volt = x_map.scalar
+    t0 = time.perf_counter()
+    mapped = [(yaw_volt(h), x_volt(x)) for h, x in zip(heading_list, intx_list)]
+    t_scalar = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    yaw_array = yaw.array(heading)
+    x_array = x_map.array(intx)
+    t_array = time.perf_counter() - t0
+
+    print('{0:<28}{1:>10.3f} us/frame'.format('inline, max(min()) clamp', t_inline / n * 1e6))
+    print('{0:<28}{1:>10.3f} us/frame  ({2:1.1f}x)'.format('ChannelMap.scalar', t_scalar / n * 1e6, t_inline / t_scalar))
+    print('{0:<28}{1:>10.3f} us/frame  ({2:1.0f}x)'.format('ChannelMap.array', t_array / n * 1e6, t_inline / t_array))
+    print('identical: scalar {0}, array {1}'.format(
+        mapped == inline, np.array_equal(np.column_stack((yaw_array, x_array)), np.array(inline))))